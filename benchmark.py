@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+"""
+End-to-end latency benchmark of the driver against emulated soundbars.
+
+Measures the latency from a media-player command received by the entity to the request frame received by the
+soundbar, and from a state pushed by the soundbar to the entity attributes update. The frame encoding, the CPU time
+of a poll, the processing of the responses captured in docs/rawdata.txt and the memory used by the device instances
+are measured without the emulated soundbar. Results are saved as JSON to compare releases.
+
+python3 benchmark.py --iterations 200 --output benchmark_results.json
+
+:copyright: (c) 2024 by Unfolded Circle ApS.
+:license: Mozilla Public License Version 2.0, see LICENSE for more details.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "intg-lgsoundbar"))
+
+# pylint: disable=C0413,E0401
+import driver  # noqa: E402
+import lglib  # noqa: E402
+from client import LGDevice  # noqa: E402
+from config import DeviceInstance  # noqa: E402
+from Crypto.Cipher import AES  # noqa: E402
+from framing import IV, KEY, decode_payload, encode_frame  # noqa: E402
+from soundbar_emulator import Faults, SoundbarEmulator  # noqa: E402
+from ucapi.media_player import Attributes, Commands  # noqa: E402
+
+
+class TimedEmulator(SoundbarEmulator):
+    """Emulated soundbar recording the arrival time of the expected requests."""
+
+    def __init__(self, *args, **kwargs):
+        """Create the emulated soundbar."""
+        super().__init__(*args, **kwargs)
+        self._waiters: list[tuple[Callable[[dict], bool], asyncio.Future]] = []
+
+    def expect(self, predicate: Callable[[dict], bool]) -> asyncio.Future:
+        """Return a future resolved with the arrival time of the next request matching the predicate."""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((predicate, future))
+        return future
+
+    async def _handle_request(self, writer: asyncio.StreamWriter, request: dict) -> None:
+        now = time.perf_counter()
+        for waiter in list(self._waiters):
+            predicate, future = waiter
+            if predicate(request) and not future.done():
+                future.set_result(now)
+                self._waiters.remove(waiter)
+        await super()._handle_request(writer, request)
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    """Return the latency percentiles in milliseconds."""
+    quantiles = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "count": len(samples),
+        "p50_ms": round(quantiles[49] * 1000, 3),
+        "p95_ms": round(quantiles[94] * 1000, 3),
+        "p99_ms": round(quantiles[98] * 1000, 3),
+        "max_ms": round(max(samples) * 1000, 3),
+    }
+
+
+async def bench_commands(entity, emulator: TimedEmulator, iterations: int) -> dict[str, Any]:
+    """Measure the latency from the entity command to the request received by the soundbar."""
+    sources = ["Bluetooth", "HDMI"]
+    commands = {
+        Commands.VOLUME_UP: (None, lambda request: "i_vol" in request.get("data", {})),
+        Commands.MUTE_TOGGLE: (None, lambda request: "b_mute" in request.get("data", {})),
+        Commands.SELECT_SOURCE: ({}, lambda request: "i_curr_func" in request.get("data", {})),
+    }
+    results = {}
+    for cmd_id, (params, predicate) in commands.items():
+        samples = []
+        for index in range(iterations):
+            if params is not None:
+                params = {"source": sources[index % len(sources)]}
+            arrival = emulator.expect(predicate)
+            start = time.perf_counter()
+            await entity.command(cmd_id, params)
+            async with asyncio.timeout(5):
+                samples.append(await arrival - start)
+        results[cmd_id.value] = percentiles(samples)
+    return results
+
+
+async def bench_throughput(entity, emulator: TimedEmulator, iterations: int) -> dict[str, Any]:
+    """Measure the rate of sequential volume commands until the last one is received by the soundbar."""
+    arrival = emulator.expect(lambda request: request.get("data", {}).get("i_vol") == -1)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await entity.command(Commands.VOLUME_UP)
+    entity._device._device.set_volume(-1)  # pylint: disable=W0212
+    async with asyncio.timeout(5):
+        elapsed = await arrival - start
+    return {"commands": iterations, "elapsed_s": round(elapsed, 4), "commands_per_s": round(iterations / elapsed)}
+
+
+async def bench_pushes(device_id: str, emulator: TimedEmulator, iterations: int) -> dict[str, Any]:
+    """Measure the latency from a state pushed by the soundbar to the media-player attributes update."""
+    entity_id = f"media_player.{device_id}"
+    entities = driver.api.configured_entities
+    update_attributes = entities.update_attributes
+    waiter: dict[str, Any] = {}
+
+    def timed_update_attributes(updated_id: str, attributes: dict[str, Any]) -> bool:
+        future = waiter.get("future")
+        if updated_id == entity_id and Attributes.VOLUME in attributes and future and not future.done():
+            future.set_result(time.perf_counter())
+        return update_attributes(updated_id, attributes)
+
+    entities.update_attributes = timed_update_attributes
+    samples = []
+    try:
+        for index in range(iterations):
+            waiter["future"] = asyncio.get_running_loop().create_future()
+            emulator.apply("SPK_LIST_VIEW_INFO", {"i_vol": 10 + index % 20})
+            start = time.perf_counter()
+            await emulator.push("SPK_LIST_VIEW_INFO")
+            async with asyncio.timeout(5):
+                samples.append(await waiter["future"] - start)
+    finally:
+        entities.update_attributes = update_attributes
+    return {"SPK_LIST_VIEW_INFO": percentiles(samples)}
+
+
+async def bench_updates(device, iterations: int) -> dict[str, Any]:
+    """
+    Measure the rate of state updates processed from the device pushes to the entity attributes updates.
+
+    The pushes are merged by the update window of the device, the last one sets a volume never published before so that
+    its update marks the end of the measurement.
+    """
+    entity_id = f"media_player.{device.id}"
+    entities = driver.api.configured_entities
+    update_attributes = entities.update_attributes
+    counts = {"pushes": 0, "published": 0}
+    done = asyncio.get_running_loop().create_future()
+    volume = device.data.volume
+    last_volume = volume + 3
+
+    def counting_update_attributes(updated_id: str, attributes: dict[str, Any]) -> bool:
+        counts["published"] += 1
+        if (
+            updated_id == entity_id
+            and Attributes.VOLUME in attributes
+            and device.data.volume == last_volume
+            and not done.done()
+        ):
+            done.set_result(time.perf_counter())
+        return update_attributes(updated_id, attributes)
+
+    # Alternate volume pushes with unchanged state refreshes, as answered to the polls
+    payloads = [
+        (
+            {"msg": "SPK_LIST_VIEW_INFO", "data": {"i_vol": volume + 1 + index % 4 // 2, "b_mute": False}}
+            if index % 2 == 0
+            else {"msg": "FUNC_VIEW_INFO", "data": {"i_curr_func": device.data.function}}
+        )
+        for index in range(iterations)
+    ]
+    payloads.append({"msg": "SPK_LIST_VIEW_INFO", "data": {"i_vol": last_volume}})
+    entities.update_attributes = counting_update_attributes
+    try:
+        start = time.perf_counter()
+        for payload in payloads:
+            device.handle_event(payload)
+            counts["pushes"] += 1
+            # Let the update handlers run
+            await asyncio.sleep(0)
+        async with asyncio.timeout(5):
+            elapsed = await done - start
+    finally:
+        entities.update_attributes = update_attributes
+    return {
+        **counts,
+        "elapsed_s": round(elapsed, 4),
+        "updates_per_s": round(counts["pushes"] / elapsed),
+    }
+
+
+def legacy_encrypt_packet(data: str) -> bytes:
+    """Encode a frame like Temescal.encrypt_packet before the framing codec, the reference of bench_encoding."""
+    padlen = 16 - (len(data) % 16)
+    for _i in range(padlen):
+        data = data + chr(padlen)
+    data = data.encode("utf-8")
+    cipher = AES.new(KEY, AES.MODE_CBC, IV)
+
+    encrypted = cipher.encrypt(data)
+    length = len(encrypted)
+    prelude = bytearray([0x10, 0x00, 0x00, 0x00, length])
+    return prelude + encrypted
+
+
+def bench_encoding(iterations: int) -> dict[str, Any]:
+    """Measure the time to encode the frame of a get request and of a set command, against the previous encoder."""
+    messages = {
+        "get": json.dumps({"cmd": "get", "msg": "SPK_LIST_VIEW_INFO"}),
+        "set": json.dumps({"cmd": "set", "data": {"i_curr_func": 6}, "msg": "FUNC_VIEW_INFO"}),
+    }
+    # The previous encoder only supports ASCII messages of less than 256 bytes, they are encoded the same way
+    for data in messages.values():
+        assert decode_payload(bytes(legacy_encrypt_packet(data)[5:])) == decode_payload(encode_frame(data)[5:])
+    results = {}
+    for name, encode in (("encode_frame", encode_frame), ("legacy_encrypt_packet", legacy_encrypt_packet)):
+        results[name] = {}
+        for kind, data in messages.items():
+            start = time.perf_counter()
+            for _ in range(iterations):
+                encode(data)
+            results[name][f"{kind}_us"] = round((time.perf_counter() - start) / iterations * 1e6, 3)
+    return results
+
+
+def bench_poll_cpu(iterations: int) -> dict[str, Any]:
+    """Measure the CPU time of the get requests of a poll, with the cached frames and with frames encoded each time."""
+    messages = ["EQ_VIEW_INFO", "SPK_LIST_VIEW_INFO", "FUNC_VIEW_INFO", "SETTING_VIEW_INFO", "PLAY_INFO"]
+    sent: list[bytes] = []
+    device = lglib.Temescal("bench")
+    device.send_frame = lambda packet, *args, **kwargs: sent.append(packet)
+
+    def cached_poll():
+        device.get_eq()
+        device.get_info()
+        device.get_func()
+        device.get_settings()
+        device.get_play()
+
+    def encoded_poll():
+        for msg in messages:
+            sent.append(encode_frame(json.dumps({"cmd": "get", "msg": msg})))
+
+    results = {}
+    for name, poll in (("cached_frames", cached_poll), ("encoded_frames", encoded_poll)):
+        start = time.process_time()
+        for _ in range(iterations):
+            poll()
+            sent.clear()
+        results[name] = {"cpu_us_per_poll": round((time.process_time() - start) / iterations * 1e6, 3)}
+    return {"requests_per_poll": len(messages), **results}
+
+
+def load_captures(path: str) -> list[dict[str, Any]]:
+    """Return the device responses captured in the JavaScript notation of docs/rawdata.txt."""
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    responses = []
+    for block in re.findall(r"^\{.*?^\}", text, re.S | re.M):
+        block = re.sub(r"(?m)^(\s*)([A-Za-z_]\w*):", r'\1"\2":', block.replace("'", '"'))
+        try:
+            response = json.loads(re.sub(r",(\s*[}\]])", r"\1", block))
+        except ValueError:
+            continue
+        if isinstance(response.get("data"), dict) and "msg" in response:
+            responses.append(response)
+    return responses
+
+
+async def bench_replay(responses: list[dict[str, Any]], iterations: int) -> dict[str, Any]:
+    """Measure the time and the memory allocated to process each captured response by a device."""
+    device = LGDevice(DeviceInstance(id="replay", name="Replay", address="", port=0, volume_step=1, always_on=False))
+    for response in responses:
+        device.handle_event(response)
+    elapsed: dict[str, list[float]] = {}
+    for _ in range(iterations):
+        for response in responses:
+            start = time.perf_counter()
+            device.handle_event(response)
+            elapsed.setdefault(response["msg"], []).append(time.perf_counter() - start)
+    tracemalloc.start()
+    for response in responses:
+        device.handle_event(response)
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "responses": len(responses),
+        "peak_alloc_bytes": peak,
+        "messages": {
+            msg: {"count": len(samples) // iterations, "us_per_message": round(statistics.mean(samples) * 1e6, 3)}
+            for msg, samples in sorted(elapsed.items())
+        },
+    }
+
+
+async def bench_memory(devices: int) -> dict[str, Any]:
+    """Measure the memory used by the device instances and the cost of copying a device state."""
+    tracemalloc.start()
+    instances = [
+        LGDevice(DeviceInstance(id=f"memory{index}", name="Memory", address="", port=0, volume_step=1, always_on=False))
+        for index in range(devices)
+    ]
+    current, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    state = instances[0].data
+    copies = 10000
+    start = time.perf_counter()
+    for _ in range(copies):
+        state.copy()
+    return {
+        "devices": len(instances),
+        "bytes_per_device": current // devices,
+        "state_copy_us": round((time.perf_counter() - start) / copies * 1e6, 3),
+    }
+
+
+async def main() -> None:
+    """Run the benchmark and save the results."""
+    parser = argparse.ArgumentParser(description="LG soundbar driver latency benchmark")
+    parser.add_argument("--iterations", type=int, default=200, help="samples per measurement")
+    parser.add_argument("--latency", type=float, default=0, help="emulated soundbar response delay in seconds")
+    parser.add_argument(
+        "--volume-window", type=float, default=None, help="volume coalescing window in seconds, 0 to send every step"
+    )
+    parser.add_argument(
+        "--update-window", type=float, default=None, help="entity update batching window in seconds, 0 for a loop cycle"
+    )
+    parser.add_argument("--devices", type=int, default=50, help="device instances of the memory measurement")
+    parser.add_argument("--output", default="benchmark_results.json", help="JSON results file")
+    args = parser.parse_args()
+
+    emulator = TimedEmulator("bench", faults=Faults(latency=args.latency))
+    await emulator.start()
+    device_config = DeviceInstance(
+        id="bench",
+        name="Bench",
+        address=emulator.host,
+        port=emulator.port,
+        volume_step=1,
+        always_on=True,
+        volume_window=args.volume_window,
+        update_window=args.update_window,
+    )
+    driver._configure_new_device(device_config, connect=False)  # pylint: disable=W0212
+    for entity_id in driver._entities_from_device(device_config.id):  # pylint: disable=W0212
+        driver.api.configured_entities.add(driver.api.available_entities.get(entity_id))
+    device = driver._configured_devices[device_config.id]  # pylint: disable=W0212
+    await device.connect()
+    await asyncio.sleep(0.5)
+
+    entity = driver.api.configured_entities.get(f"media_player.{device_config.id}")
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "iterations": args.iterations,
+        "emulated_latency_s": args.latency,
+        "volume_window_s": args.volume_window,
+        "update_window_s": args.update_window,
+        "command_to_wire": await bench_commands(entity, emulator, args.iterations),
+        "command_throughput": await bench_throughput(entity, emulator, args.iterations * 10),
+    }
+    # Let the coalesced volume change be sent, the volume pushes are ignored until then
+    await asyncio.sleep(1)
+    results |= {
+        "push_to_entity": await bench_pushes(device_config.id, emulator, args.iterations),
+        "update_throughput": await bench_updates(device, args.iterations * 50),
+        "update_events": device.update_stats,
+        "optimistic_changes": device.optimistic_stats,
+        "polling": device.polling_stats,
+        "connection": device.connect_stats,
+        "send_queue": device.send_queue_stats,
+        "frame_encoding": bench_encoding(args.iterations * 50),
+        "poll_cpu": bench_poll_cpu(args.iterations * 50),
+        "response_replay": await bench_replay(
+            load_captures(os.path.join(os.path.dirname(os.path.abspath(__file__)), "docs", "rawdata.txt")),
+            args.iterations * 10,
+        ),
+        "device_memory": await bench_memory(args.devices),
+    }
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), "driver.json"), encoding="utf-8") as f:
+        results["version"] = json.load(f).get("version")
+
+    await device.stop_polling()
+    await device.disconnect()
+    await emulator.stop()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    driver._LOOP.run_until_complete(main())  # pylint: disable=W0212
@@ -7,20 +7,43 @@ This module implements the LG soundbar communication of the Remote Two integrati
 
 # coding: utf-8
 import asyncio
+import dataclasses
+import json
 import logging
-from asyncio import CancelledError, Lock, shield
+import os
+import time
+from asyncio import Lock
 from datetime import timedelta
 from enum import IntEnum
 from functools import wraps
-from typing import Any, Awaitable, Callable, Concatenate, Coroutine, ParamSpec, TypeVar
+from typing import Any, Awaitable, Callable, Collection, Concatenate, Coroutine, NamedTuple, ParamSpec, TypeVar
 
 import ucapi.media_player
-from aiohttp import ClientError, ClientSession
+from aiohttp import ClientSession
 from config import DeviceInstance
+from const import (
+    COMMAND_RECONNECT_TIMEOUT,
+    CONNECT_BACKOFF_MAX,
+    CONNECT_TIMEOUT,
+    LIVENESS_INTERVAL,
+    LIVENESS_TIMEOUT,
+    OPTIMISTIC_TIMEOUT,
+    POLL_INTERVAL_PLAYING,
+    POLL_PUSH_BACKOFF,
+    POSITION_INTERVAL,
+    POSITION_SEEK_TOLERANCE,
+    SNAPSHOT_DELAY,
+    STATS_LOG_INTERVAL,
+    UPDATE_WINDOW,
+    VOLUME_WINDOW,
+)
 from pyee.asyncio import AsyncIOEventEmitter
 from ucapi.media_player import Attributes, Commands, MediaType, States
 
-from lglib import Temescal, equalisers, functions
+from lglib import NotConnectedError, Temescal, TemescalError, equaliser_ids, function_ids
+from outbound import create_queue
+from polling import POLL_RULES, PollState, scheduler
+from state import SNAPSHOT_FIELDS, ChangeTracker, DeviceState
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -37,6 +60,106 @@ class Events(IntEnum):
     DISCONNECTED = 4
 
 
+class Field(NamedTuple):
+    """Mapping of a key of the device responses to a device field."""
+
+    name: str
+    """Field of DeviceState."""
+    published: bool = False
+    """True if a change of the field changes the attributes of the entities."""
+    merge: Callable[[Any, Any], Any] | None = None
+    """Compute the new field value from the current one and the received one."""
+
+
+def _position(_current: int, value: int) -> int:
+    return 0 if value == -1 else value
+
+
+def _function_list(current: list[int], value: list[int]) -> list[int]:
+    # Sources found by check_source are kept until the device reports a longer list
+    return value if len(value) > len(current) else current
+
+
+# Message type -> response key -> device field
+RESPONSE_FIELDS: dict[str, dict[str, Field]] = {
+    "EQ_VIEW_INFO": {
+        "i_bass": Field("bass"),
+        "i_treble": Field("treble"),
+        "ai_eq_list": Field("equalisers", published=True),
+        "i_curr_eq": Field("equaliser", published=True),
+    },
+    "SPK_LIST_VIEW_INFO": {
+        "b_powerstatus": Field("power_state", published=True),
+        "i_vol": Field("volume", published=True),
+        "i_vol_min": Field("volume_min", published=True),
+        "i_vol_max": Field("volume_max", published=True),
+        "b_mute": Field("mute", published=True),
+        "i_curr_func": Field("function", published=True),
+    },
+    "FUNC_VIEW_INFO": {
+        "i_curr_func": Field("function", published=True),
+        "ai_func_list": Field("functions", published=True, merge=_function_list),
+    },
+    "SETTING_VIEW_INFO": {
+        "i_rear_min": Field("rear_volume_min"),
+        "i_rear_max": Field("rear_volume_max"),
+        "i_rear_level": Field("rear_volume"),
+        "i_woofer_min": Field("woofer_volume_min"),
+        "i_woofer_max": Field("woofer_volume_max"),
+        "i_woofer_level": Field("woofer_volume"),
+        "i_curr_eq": Field("equaliser", published=True),
+        "s_user_name": Field("device_name"),
+        "b_night_mode": Field("night_mode"),
+        "b_auto_vol": Field("auto_volume_control"),
+        "b_drc": Field("dynamic_range_reduction"),
+        "b_neuralx": Field("neural_x"),
+        "b_tv_remote": Field("tv_remote"),
+        "b_auto_display": Field("auto_display"),
+    },
+    "PLAY_INFO": {
+        "s_title": Field("media_title", published=True),
+        "s_artist": Field("media_artist", published=True),
+        "i_position": Field("media_position", published=True, merge=_position),
+        "i_duration": Field("media_duration", published=True, merge=_position),
+        "s_albumart": Field("media_artwork", published=True),
+        "i_stream_type": Field("stream_type", published=True),
+        "i_play_ctrl": Field("play_control", published=True),
+    },
+    "PRODUCT_INFO": {
+        "s_uuid": Field("serial_number"),
+    },
+}
+
+# Flattened table used by LGDevice.handle_event
+_DISPATCH = {msg: tuple((key, *field) for key, field in fields.items()) for msg, fields in RESPONSE_FIELDS.items()}
+# Device field -> message type reporting it, and whether a change of the field is published to the entities
+_FIELD_MESSAGES = {field.name: msg for msg, fields in reversed(RESPONSE_FIELDS.items()) for field in fields.values()}
+_FIELD_PUBLISHED = {field.name: field.published for fields in RESPONSE_FIELDS.values() for field in fields.values()}
+
+
+# Toggle command -> device field, setter of the Temescal client
+_MODE_COMMANDS: dict[str, tuple[str, Callable[[Temescal, bool], None]]] = {
+    "MODE_NIGHT": ("night_mode", Temescal.set_night_mode),
+    "MODE_AUTO_VOLUME_CONTROL": ("auto_volume_control", Temescal.set_avc),
+    "MODE_DYNAMIC_RANGE_COMPRESSION": ("dynamic_range_reduction", Temescal.set_drc),
+    "MODE_NEURALX": ("neural_x", Temescal.set_neuralx),
+    "MODE_TV_REMOTE": ("tv_remote", Temescal.set_tv_remote),
+    "MODE_AUTO_DISPLAY": ("auto_display", Temescal.set_auto_display),
+}
+
+
+@dataclasses.dataclass(slots=True)
+class _Expectation:
+    """Field value expected after a command, until the device reports the field."""
+
+    value: Any
+    previous: Any
+    """Value before the first of the pending commands on the field."""
+    superseded: list[Any]
+    """Values expected by the previous pending commands, which the device may still report."""
+    timer: asyncio.TimerHandle
+
+
 _LGDeviceT = TypeVar("_LGDeviceT", bound="LGDevice")
 _P = ParamSpec("_P")
 
@@ -51,47 +174,38 @@ def cmd_wrapper(
         """Wrap all command methods."""
         # pylint: disable = W0212
         try:
-            await func(obj, *args, **kwargs)
-            await obj.start_polling()
-            return ucapi.StatusCodes.OK
-        except ClientError as exc:
-            # If Kodi is off, we expect calls to fail.
-            if obj.state == States.OFF:
-                log_function = _LOGGER.debug
-            else:
-                log_function = _LOGGER.error
-            log_function(
-                "Error calling %s on entity %s: %r trying to reconnect and send the command next",
-                func.__name__,
-                obj.id,
-                exc,
-            )
-            # Kodi not connected, launch a connect task but
-            # don't wait more than 5 seconds, then process the command if connected
-            # else returns error
-            connect_task = obj.event_loop.create_task(obj.connect())
-            await asyncio.sleep(0)
             try:
-                async with asyncio.timeout(5):
-                    await shield(connect_task)
-            except asyncio.TimeoutError:
-                log_function("Timeout for reconnect, command won't be sent")
-            else:
-                if not obj._connect_error:
-                    try:
-                        await func(obj, *args, **kwargs)
-                        return ucapi.StatusCodes.OK
-                    except ClientError as ex:
-                        log_function(
-                            "Error calling %s on entity %s: %r trying to reconnect",
-                            func.__name__,
-                            obj.id,
-                            ex,
-                        )
-            return ucapi.StatusCodes.BAD_REQUEST
+                result = await func(obj, *args, **kwargs)
+            except NotConnectedError as exc:
+                # If the device is off, we expect calls to fail.
+                if obj.state == States.OFF:
+                    log_function = _LOGGER.debug
+                else:
+                    log_function = _LOGGER.warning
+                log_function(
+                    "Error calling %s on entity %s: %r trying to reconnect and send the command again",
+                    func.__name__,
+                    obj.id,
+                    exc,
+                )
+                # Reconnect once, but don't wait more than COMMAND_RECONNECT_TIMEOUT before giving up
+                try:
+                    async with asyncio.timeout(COMMAND_RECONNECT_TIMEOUT):
+                        await obj._device.connect(backoff=False)
+                except (TemescalError, asyncio.TimeoutError) as ex:
+                    log_function("Reconnect of %s failed, command %s not sent: %r", obj.id, func.__name__, ex)
+                    return ucapi.StatusCodes.SERVICE_UNAVAILABLE
+                # Polling stops when the device is turned off, resume it with the new connection
+                await obj.start_polling()
+                result = await func(obj, *args, **kwargs)
+            return result if isinstance(result, ucapi.StatusCodes) else ucapi.StatusCodes.OK
+        except TemescalError as ex:
+            _LOGGER.error("Error calling %s on entity %s: %r", func.__name__, obj.id, ex)
+            return ucapi.StatusCodes.SERVICE_UNAVAILABLE
         # pylint: disable = W0718
         except Exception as ex:
             _LOGGER.error("Unknown error %s %s", func.__name__, ex)
+            return ucapi.StatusCodes.SERVER_ERROR
 
     return wrapper
 
@@ -99,8 +213,11 @@ def cmd_wrapper(
 class LGDevice:
     """LG client library."""
 
-    def __init__(self, device_config: DeviceInstance, timeout=3, refresh_frequency=60):
-        """Initialize of a LG soundbar instance."""
+    def __init__(
+        self, device_config: DeviceInstance, timeout=3, refresh_frequency=60, snapshot_path: str | None = None
+    ):
+        """Initialize of a LG soundbar instance, its state is persisted in snapshot_path if given."""
+        # pylint: disable = R0915
         self._id = device_config.id
         self._name = device_config.name
         self._hostname = device_config.address
@@ -108,226 +225,419 @@ class LGDevice:
         self._device_config = device_config
         self._timeout = timeout
         self.refresh_frequency = timedelta(seconds=refresh_frequency)
-        self._state = States.UNKNOWN
         self._event_loop = asyncio.get_event_loop() or asyncio.get_running_loop()
         self.events = AsyncIOEventEmitter(self._event_loop)
         self._update_lock = Lock()
         self._session: ClientSession | None = None
-        self._device = Temescal(self._hostname, self._port, self.handle_event, _LOGGER)
+        self._liveness_interval = (
+            LIVENESS_INTERVAL if device_config.liveness_interval is None else device_config.liveness_interval
+        )
+        self._liveness_task: asyncio.Task | None = None
+        self._available = True
+        self._device = Temescal(
+            self._hostname,
+            self._port,
+            self.handle_event,
+            _LOGGER,
+            create_queue(device_config.send_queue, device_config.id),
+            CONNECT_TIMEOUT if device_config.connect_timeout is None else device_config.connect_timeout,
+            CONNECT_BACKOFF_MAX,
+            int(self._liveness_interval),
+        )
         self._volume_step = device_config.volume_step
-        self._volume = 0
-        self._volume_min = 0
-        self._volume_max = 0
-        self._power_state = False
-        self._function = -1
-        self._functions = []
-        self._equaliser = -1
-        self._equalisers: list[int] = []
-        self._mute = False
-        self._rear_volume = 0
-        self._rear_volume_min = 0
-        self._rear_volume_max = 0
-        self._woofer_volume = 0
-        self._woofer_volume_min = 0
-        self._woofer_volume_max = 0
-        self._bass = 0
-        self._treble = 0
-        self._media_artist = ""
-        self._media_title = ""
-        self._media_position = 0
-        self._media_duration = 0
-        self._media_artwork = ""
-        self._device_name = "LG"
-        self._night_mode = False
-        self._auto_volume_control = False
-        self._dynamic_range_reduction = False
-        self._neural_x = False
-        self._tv_remote = False
-        self._auto_display = False
+        self._volume_window = VOLUME_WINDOW if device_config.volume_window is None else device_config.volume_window
+        self._volume_sent = float("-inf")
+        self._volume_task: asyncio.Task | None = None
+        self._data = DeviceState()
+        self._changes = ChangeTracker(
+            POSITION_INTERVAL if device_config.position_interval is None else device_config.position_interval,
+            POSITION_SEEK_TOLERANCE,
+        )
+        self._update_window = UPDATE_WINDOW if device_config.update_window is None else device_config.update_window
+        self._pending_timer: asyncio.Handle | None = None
+        self._updates_requested = 0
+        self._updates_emitted = 0
+        self._expected: dict[str, _Expectation] = {}
+        self._optimistic_stats = {
+            "published": 0,
+            "confirmed": 0,
+            "rolled_back": 0,
+            "timed_out": 0,
+            "superseded": 0,
+            "discarded": 0,
+        }
+        self._snapshot_path = snapshot_path
+        self._snapshot_timer: asyncio.TimerHandle | None = None
+        self._saved_snapshot: dict[str, Any] | None = None
         self._reconnect_retry = 0
-        self._update_task = None
-        self._stream_type = 0
-        self._play_control = 0
-        self._serial_number = None
+        self._stats_logged = time.monotonic()
         self._connect_lock = Lock()
+        poll_intervals = device_config.poll_intervals or {}
+        self._polling = {
+            msg: PollState(dataclasses.replace(rule, interval=poll_intervals.get(msg, rule.interval)))
+            for msg, rule in POLL_RULES.items()
+        }
 
     def handle_event(self, response):
         """Handle responses from the speakers."""
-        # pylint: disable = R0914,R0915
+        msg = response.get("msg")
         data = response.get("data") or {}
-        update_data = {}
-        if response["msg"] == "EQ_VIEW_INFO":
-            if "i_bass" in data:
-                self._bass = data["i_bass"]
-            if "i_treble" in data:
-                self._treble = data["i_treble"]
-            if "ai_eq_list" in data and len(self._equalisers) != len(data["ai_eq_list"]):
-                self._equalisers = data["ai_eq_list"]
-                update_data[Attributes.SOUND_MODE_LIST] = self.sound_mode_list
-            if "i_curr_eq" in data and self._equaliser != data["i_curr_eq"]:
-                self._equaliser = data["i_curr_eq"]
-                update_data[Attributes.SOUND_MODE] = self.sound_mode
-        elif response["msg"] == "SPK_LIST_VIEW_INFO":
-            current_volume = self.volume
-            current_mute = self.muted
-            current_state = self.state
-            if "b_powerstatus" in data:
-                self._power_state = data["b_powerstatus"]
-            if "i_vol" in data:
-                self._volume = data["i_vol"]
-            if "i_vol_min" in data:
-                self._volume_min = data["i_vol_min"]
-            if "i_vol_max" in data:
-                self._volume_max = data["i_vol_max"]
-            if "b_mute" in data:
-                self._mute = data["b_mute"]
-            if "i_curr_func" in data:
-                self._function = data["i_curr_func"]
-                if self.check_source(self._function):
-                    update_data[Attributes.SOURCE_LIST] = self.source_list
-
-            if current_state != self.state:
-                update_data[Attributes.STATE] = self.state
-            if current_volume != self.volume:
-                update_data[Attributes.VOLUME] = self.volume
-            if current_mute != self.muted:
-                update_data[Attributes.MUTED] = self.muted
-        elif response["msg"] == "FUNC_VIEW_INFO":
-            current_source = self.source
-            current_functions = self.source_list
-            if "i_curr_func" in data:
-                self._function = data["i_curr_func"]
-                if self.check_source(self._function):
-                    update_data[Attributes.SOURCE_LIST] = self.source_list
-            if "ai_func_list" in data:
-                if len(data["ai_func_list"]) > len(self._functions):
-                    self._functions = data["ai_func_list"]
-            if current_source != self.source:
-                update_data[Attributes.SOURCE] = self.source
-            if len(current_functions) != len(self.source_list):
-                update_data[Attributes.SOURCE_LIST] = self.source_list
-        elif response["msg"] == "SETTING_VIEW_INFO":
-            if "i_rear_min" in data:
-                self._rear_volume_min = data["i_rear_min"]
-            if "i_rear_max" in data:
-                self._rear_volume_max = data["i_rear_max"]
-            if "i_rear_level" in data:
-                self._rear_volume = data["i_rear_level"]
-            if "i_woofer_min" in data:
-                self._woofer_volume_min = data["i_woofer_min"]
-            if "i_woofer_max" in data:
-                self._woofer_volume_max = data["i_woofer_max"]
-            if "i_woofer_level" in data:
-                self._woofer_volume = data["i_woofer_level"]
-            if "i_curr_eq" in data:
-                self._equaliser = data["i_curr_eq"]
-            if "s_user_name" in data:
-                self._device_name = data["s_user_name"]
-            if "b_night_mode" in data:
-                self._night_mode = data["b_night_mode"]
-            if "b_auto_vol" in data:
-                self._auto_volume_control = data["b_auto_vol"]
-            if "b_drc" in data:
-                self._dynamic_range_reduction = data["b_drc"]
-            if "b_neuralx" in data:
-                self._neural_x = data["b_neuralx"]
-            if "b_tv_remote" in data:
-                self._tv_remote = data["b_tv_remote"]
-            if "b_auto_display" in data:
-                self._auto_display = data["b_auto_display"]
-        elif response["msg"] == "PLAY_INFO":
-            current_playstate = self.play_state
-            current_title = self.media_title
-            current_artist = self.media_artist
-            current_position = self.media_position
-            current_duration = self.media_duration
-            current_artwork = self.media_image_url
-            if "s_title" in data:
-                self._media_title = data["s_title"]
-            if "s_artist" in data:
-                self._media_artist = data["s_artist"]
-            if "i_position" in data:
-                self._media_position = data["i_position"]
-                if self._media_position == -1:
-                    self._media_position = 0
-            if "i_duration" in data:
-                self._media_duration = data["i_duration"]
-                if self._media_duration == -1:
-                    self._media_duration = 0
-            if "s_albumart" in data:
-                self._media_artwork = data["s_albumart"]
-            if "i_stream_type" in data:
-                self._stream_type = data.get("i_stream_type", 0)
-            if "i_play_ctrl" in data:
-                self._play_control = data.get("i_play_ctrl", 0)
-
-            if current_title != self.media_title:
-                update_data[Attributes.MEDIA_TITLE] = self.media_title
-            if current_artist != self.media_artist:
-                update_data[Attributes.MEDIA_ARTIST] = self.media_artist
-            if current_position != self.media_position:
-                update_data[Attributes.MEDIA_POSITION] = self.media_position
-            if current_duration != self.media_duration:
-                update_data[Attributes.MEDIA_DURATION] = self.media_duration
-            if current_artwork != self.media_image_url:
-                update_data[Attributes.MEDIA_IMAGE_URL] = self.media_image_url
-
-        elif response["msg"] == "PRODUCT_INFO":
-            if "s_uuid" in data:
-                self._serial_number = data["s_uuid"]
-
-        if update_data:
-            self.events.emit(Events.UPDATE, self.id, update_data)
-
-    async def connect(self):
-        """Connect to a LG soundbar."""
-        if self._connect_lock.locked():
-            _LOGGER.debug("Connection already in progress")
+        poll = self._polling.get(msg)
+        if poll:
+            poll.responses += 1
+            poll.last_received = time.monotonic()
+            if response.get("cmd") != "notibyget":
+                poll.pushes += 1
+                poll.last_pushed = poll.last_received
+        fields = _DISPATCH.get(msg)
+        if not fields:
             return
+        if self._volume_task is not None and "i_vol" in data:
+            # A coalesced volume change is pending, its target is more recent than the reported volume
+            data = {key: value for key, value in data.items() if key != "i_vol"}
+
+        publish = False
+        changed_fields = []
+        state = self._data
+        for key, name, published, merge in fields:
+            if key not in data:
+                continue
+            value = data[key]
+            current = getattr(state, name)
+            if merge:
+                value = merge(current, value)
+            if self._expected and name in self._expected and not self._reconcile(name, value):
+                continue
+            if value != current:
+                setattr(state, name, value)
+                changed_fields.append(name)
+                publish = publish or published
+        if "i_curr_func" in data and self.check_source(state.function):
+            changed_fields.append("functions")
+            publish = True
+        if changed_fields:
+            state.update_derived(changed_fields)
+            self._schedule_snapshot(changed_fields)
+
+        if publish:
+            self._emit_update()
+
+    def _schedule_snapshot(self, changed_fields: Collection[str]) -> None:
+        """Save the snapshot after SNAPSHOT_DELAY if one of the changed fields is persisted."""
+        if self._snapshot_path and self._snapshot_timer is None and not SNAPSHOT_FIELDS.isdisjoint(changed_fields):
+            self._snapshot_timer = self._event_loop.call_later(SNAPSHOT_DELAY, self.save_snapshot)
+
+    def _emit_update(self) -> None:
+        """
+        Emit an update event at the end of the batching window, the changed fields are found by published_changes.
+
+        The updates of the window are merged into a single event, so that the responses to a poll cycle update the
+        entities once.
+        """
+        self._updates_requested += 1
+        if self._pending_timer is not None:
+            return
+        if self._update_window > 0:
+            self._pending_timer = self._event_loop.call_later(self._update_window, self._flush_update)
+        else:
+            self._pending_timer = self._event_loop.call_soon(self._flush_update)
+
+    def _flush_update(self) -> None:
+        self._pending_timer = None
+        self._updates_emitted += 1
+        self.events.emit(Events.UPDATE, self.id)
+
+    def _cancel_update(self) -> None:
+        if self._pending_timer:
+            self._pending_timer.cancel()
+        self._pending_timer = None
+
+    def _expect(self, **changes: Any) -> None:
+        """
+        Apply the field changes expected from a command sent to the device and publish them at once.
+
+        The next report of each field by the device confirms the change or replaces it. A change which isn't reported
+        within OPTIMISTIC_TIMEOUT is rolled back, and the field requested again.
+        """
+        state = self._data
+        publish = False
+        for name, value in changes.items():
+            timer = self._event_loop.call_later(OPTIMISTIC_TIMEOUT, self._expire_expectation, name)
+            if (expectation := self._expected.get(name)) is not None:
+                expectation.timer.cancel()
+                expectation.superseded.append(expectation.value)
+                self._optimistic_stats["superseded"] += 1
+                expectation.value = value
+                expectation.timer = timer
+            else:
+                self._expected[name] = _Expectation(value, getattr(state, name), [], timer)
+            setattr(state, name, value)
+            publish = publish or _FIELD_PUBLISHED[name]
+        state.update_derived()
+        self._schedule_snapshot(changes)
+        self._optimistic_stats["published"] += len(changes)
+        if publish:
+            self._emit_update()
+
+    def _reconcile(self, name: str, value: Any) -> bool:
+        """
+        Reconcile the expected value of a field with the value reported by the device, return True to apply it.
+
+        The previous values may be reported by responses sent before the pending commands were processed, they are
+        ignored until the expected change is reported or times out.
+        """
+        expectation = self._expected[name]
+        if value == expectation.value:
+            self._optimistic_stats["confirmed"] += 1
+        elif value == expectation.previous or value in expectation.superseded:
+            return False
+        else:
+            self._optimistic_stats["rolled_back"] += 1
+            _LOGGER.info("Device %s reported %s=%r instead of %r", self.id, name, value, expectation.value)
+        expectation.timer.cancel()
+        del self._expected[name]
+        return True
+
+    def _expire_expectation(self, name: str) -> None:
+        expectation = self._expected.pop(name)
+        self._optimistic_stats["timed_out"] += 1
+        _LOGGER.warning(
+            "Device %s didn't report %s=%r, rolled back to %r", self.id, name, expectation.value, expectation.previous
+        )
+        state = self._data
+        setattr(state, name, expectation.previous)
+        state.update_derived()
+        self._schedule_snapshot((name,))
+        if _FIELD_PUBLISHED[name]:
+            self._emit_update()
         try:
-            await self._connect_lock.acquire()
-            self._device.connect()
-            await self.update()
-            await self.start_polling()
-            self.events.emit(Events.CONNECTED, self.id)
-        except Exception as ex:
-            _LOGGER.error("Failed to connect %s", ex)
-        self._connect_lock.release()
+            self._device.get(_FIELD_MESSAGES[name])
+        except TemescalError:
+            pass
+
+    def _clear_expectations(self) -> None:
+        for expectation in self._expected.values():
+            expectation.timer.cancel()
+        self._optimistic_stats["discarded"] += len(self._expected)
+        self._expected.clear()
+
+    @property
+    def optimistic_stats(self) -> dict[str, int]:
+        """
+        Return the number of expected field changes published and how they ended.
+
+        Each published change is confirmed, rolled back, timed out, superseded by the next command on the same field,
+        discarded when the device stopped responding, or still pending.
+        """
+        return self._optimistic_stats | {"pending": len(self._expected)}
+
+    @property
+    def update_stats(self) -> dict[str, int]:
+        """Return the number of update events requested, emitted and saved by the batching window."""
+        return {
+            "requested": self._updates_requested,
+            "emitted": self._updates_emitted,
+            "saved": self._updates_requested - self._updates_emitted - (self._pending_timer is not None),
+        }
+
+    def load_snapshot(self) -> bool:
+        """Restore the state saved by a previous run, return True if it was found."""
+        if not self._snapshot_path:
+            return False
+        try:
+            with open(self._snapshot_path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            self._data.restore(snapshot)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError, TypeError, AttributeError) as ex:
+            _LOGGER.warning("Invalid state snapshot of %s will be ignored: %s", self.id, ex)
+            return False
+        self._saved_snapshot = self._data.to_snapshot()
+        return True
+
+    def save_snapshot(self) -> bool:
+        """Save the state to restore on next start if it changed, return True if the snapshot is up-to-date."""
+        self._snapshot_timer = None
+        snapshot = self._data.to_snapshot()
+        if not self._snapshot_path or snapshot == self._saved_snapshot:
+            return True
+        try:
+            # Written aside then renamed, a crash never leaves a truncated snapshot
+            with open(self._snapshot_path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(self._snapshot_path + ".tmp", self._snapshot_path)
+        except OSError as ex:
+            _LOGGER.error("Cannot save the state snapshot of %s: %s", self.id, ex)
+            return False
+        self._saved_snapshot = snapshot
+        return True
+
+    def discard_snapshot(self) -> None:
+        """Stop saving the state, after the device was removed."""
+        if self._snapshot_timer:
+            self._snapshot_timer.cancel()
+            self._snapshot_timer = None
+        self._snapshot_path = None
+
+    async def connect(self) -> bool:
+        """Connect to a LG soundbar and wait for its main state, return True on success."""
+        if self._connect_lock.locked():
+            _LOGGER.debug("Connection already in progress")
+            return False
+        async with self._connect_lock:
+            try:
+                await self._device.connect(backoff=False)
+                # The main message types are awaited, the other ones are polled without waiting for their responses
+                awaited = ("SPK_LIST_VIEW_INFO", "FUNC_VIEW_INFO")
+                await self._poll(
+                    [msg for msg, poll in self._polling.items() if not poll.rule.full_only and msg not in awaited]
+                )
+                await asyncio.gather(*(self.request(msg) for msg in awaited))
+                await self.start_polling()
+                if self._available:
+                    self.events.emit(Events.CONNECTED, self.id)
+                else:
+                    self._set_available(True)
+                return True
+            except TemescalError as ex:
+                _LOGGER.error("Failed to connect %s", ex)
+                self._set_available(False, ex)
+                # The polling retries to connect
+                await self.start_polling()
+            except Exception as ex:
+                _LOGGER.error("Failed to connect %s", ex)
+        return False
 
     async def start_polling(self):
-        """Start polling task."""
-        if self._update_task is not None:
-            return
-        _LOGGER.debug("Start polling task for device %s", self.id)
-        self._update_task = self._event_loop.create_task(self._background_update_task())
+        """Start polling the device with the shared scheduler, and watching its liveness."""
+        if not scheduler.is_registered(self):
+            scheduler.register(self)
+        if self._liveness_interval > 0 and (self._liveness_task is None or self._liveness_task.done()):
+            self._liveness_task = self._event_loop.create_task(self._watch_liveness())
 
     async def stop_polling(self):
-        """Stop polling task."""
-        if self._update_task:
+        """Stop polling the device."""
+        scheduler.unregister(self)
+        if self._liveness_task:
+            self._liveness_task.cancel()
+            self._liveness_task = None
+
+    async def _watch_liveness(self):
+        """Probe the device when nothing was received for the liveness interval, reconnect if it does not answer."""
+        while scheduler.is_registered(self):
+            idle = time.monotonic() - self._device.last_received
+            if idle < self._liveness_interval:
+                await asyncio.sleep(self._liveness_interval - idle)
+                continue
             try:
-                self._update_task.cancel()
-            except CancelledError:
-                pass
-            self._update_task = None
-
-    async def _background_update_task(self):
-        self._reconnect_retry = 0
-        while True:
-            if not self._device_config.always_on:
-                if self.state == States.OFF:
-                    self._reconnect_retry += 1
-                    if self._reconnect_retry > CONNECTION_RETRIES:
-                        _LOGGER.debug("Stopping update task as the device %s is off", self.id)
-                        break
-                    _LOGGER.debug("Device %s is off, retry %s", self.id, self._reconnect_retry)
-                elif self._reconnect_retry > 0:
+                await self._device.request("SPK_LIST_VIEW_INFO", LIVENESS_TIMEOUT)
+            except TemescalError as ex:
+                if not scheduler.is_registered(self):
+                    # Polling stopped meanwhile as the device is off
+                    return
+                self._set_available(False, ex)
+                # The connection may be half-open, replace it right away
+                self._device.disconnect()
+                try:
+                    await self._device.connect(backoff=False)
+                    await self._device.request("SPK_LIST_VIEW_INFO", LIVENESS_TIMEOUT)
+                except TemescalError:
+                    await asyncio.sleep(self._liveness_interval)
+                    continue
+            self._set_available(True)
+
+    def _set_available(self, available: bool, error: Exception | None = None):
+        if available == self._available:
+            return
+        self._available = available
+        if available:
+            _LOGGER.info("Device %s is responding again", self.id)
+            self.events.emit(Events.CONNECTED, self.id)
+            self._emit_update()
+        else:
+            _LOGGER.warning("Device %s is not responding: %r", self.id, error)
+            # The entities are unavailable, a pending update would override it
+            self._cancel_update()
+            self._clear_expectations()
+            self.events.emit(Events.DISCONNECTED, self.id)
+
+    def next_poll(self) -> tuple[float, int]:
+        """Return the time and the best priority of the next due message types."""
+        schedule = [(self._next_poll(msg), poll.rule.priority) for msg, poll in self._polling.items()]
+        when = min(when for when, _priority in schedule)
+        return when, min(priority for due, priority in schedule if due <= max(when, time.monotonic()))
+
+    async def poll_due(self) -> bool:
+        """Poll the due message types, return False to stop polling the device."""
+        now = time.monotonic()
+        messages = sorted(
+            (msg for msg in self._polling if self._next_poll(msg) <= now),
+            key=lambda msg: self._polling[msg].rule.priority,
+        )
+        self._log_stats(now)
+        if "SPK_LIST_VIEW_INFO" in messages and not self._device_config.always_on:
+            if self.state == States.OFF:
+                self._reconnect_retry += 1
+                if self._reconnect_retry > CONNECTION_RETRIES:
+                    _LOGGER.debug("Stopping polling as the device %s is off", self.id)
                     self._reconnect_retry = 0
-                    _LOGGER.debug("Device %s is on again", self.id)
-            await self.update()
-            await asyncio.sleep(10)
-        if not self._device_config.always_on:
-            self._device.disconnect()
-        self._update_task = None
+                    self._device.disconnect()
+                    return False
+                _LOGGER.debug("Device %s is off, retry %s", self.id, self._reconnect_retry)
+            elif self._reconnect_retry > 0:
+                self._reconnect_retry = 0
+                _LOGGER.debug("Device %s is on again", self.id)
+        if messages:
+            await self._poll(messages)
+        return True
+
+    def poll_interval(self, msg: str) -> float:
+        """Return the effective polling interval of the given message type."""
+        poll = self._polling[msg]
+        interval = poll.rule.interval
+        if msg == "PLAY_INFO" and self.play_state == States.PLAYING:
+            interval = min(interval, POLL_INTERVAL_PLAYING)
+        # The device pushes this message by itself, polling is only a fallback
+        if time.monotonic() - poll.last_pushed < interval * POLL_PUSH_BACKOFF:
+            interval *= POLL_PUSH_BACKOFF
+        return interval
+
+    def _next_poll(self, msg: str) -> float:
+        poll = self._polling[msg]
+        return max(poll.last_requested, poll.last_received) + self.poll_interval(msg) + poll.jitter
+
+    def _log_stats(self, now: float) -> None:
+        """Log the statistics of the device at debug level, at most every STATS_LOG_INTERVAL."""
+        if now - self._stats_logged < STATS_LOG_INTERVAL or not _LOGGER.isEnabledFor(logging.DEBUG):
+            return
+        self._stats_logged = now
+        _LOGGER.debug("Polling statistics of %s: %s", self.id, self.polling_stats)
+        _LOGGER.debug("Connection statistics of %s: %s", self.id, self.connect_stats)
+        _LOGGER.debug("Send queue statistics of %s: %s", self.id, self.send_queue_stats)
+
+    @property
+    def polling_stats(self) -> dict[str, dict[str, float]]:
+        """Return the effective polling interval and the counters per message type."""
+        return {
+            msg: {
+                "interval": self.poll_interval(msg),
+                "requests": poll.requests,
+                "responses": poll.responses,
+                "pushes": poll.pushes,
+            }
+            for msg, poll in self._polling.items()
+        }
+
+    @property
+    def connect_stats(self) -> dict[str, float]:
+        """Return the connection attempts, failures and durations."""
+        return self._device.connect_stats
+
+    @property
+    def send_queue_stats(self) -> dict[str, int]:
+        """Return the depth and the counters of the send queue."""
+        return self._device.send_queue.stats
 
     async def disconnect(self):
         """Connect from a LG soundbar."""
@@ -338,22 +648,45 @@ class LGDevice:
 
     async def update(self, full=False):
         """Trigger updates from the device."""
+        messages = [msg for msg, poll in self._polling.items() if full or not poll.rule.full_only]
+        await self._poll(messages)
+
+    async def _poll(self, messages: list[str]):
+        """Send get requests for the given message types."""
+        now = time.monotonic()
+        for msg in messages:
+            if msg in self._polling:
+                self._polling[msg].requested(now)
         if self._update_lock.locked():
             return
 
         await self._update_lock.acquire()
         # if self._session is None:
         #     await self.connect()
-        self._device.connect()
-        self._device.get_eq()
-        self._device.get_info()
-        self._device.get_func()
-        self._device.get_settings()
-        self._device.get_play()
-        if full:
-            self._device.get_product_info()
+        try:
+            await self._device.connect()
+        except TemescalError:
+            self._update_lock.release()
+            return
+        bytes_sent, writes = self._device.bytes_sent, self._device.writes
+        with self._device.batch():
+            for msg in messages:
+                self._device.get(msg)
+        _LOGGER.debug(
+            "Poll of %s %s: %d bytes in %d writes",
+            self.id,
+            messages,
+            self._device.bytes_sent - bytes_sent,
+            self._device.writes - writes,
+        )
         self._update_lock.release()
 
+    async def request(self, msg: str) -> dict:
+        """Request the given message type and return the response, the device state is updated when it returns."""
+        if msg in self._polling:
+            self._polling[msg].requested(time.monotonic())
+        return await self._device.request(msg, self._timeout)
+
     async def update_volume(self):
         """Trigger updates from the device."""
         if self._update_lock.locked():
@@ -388,6 +721,19 @@ class LGDevice:
         }
         return updated_data
 
+    @property
+    def data(self) -> DeviceState:
+        """Return the current state of the device, not to be modified."""
+        return self._data
+
+    def published_changes(self) -> list[str]:
+        """Return the fields of the state changed since they were last published to the entities."""
+        return self._changes.changes(self._data, time.monotonic())
+
+    def reset_published(self) -> None:
+        """Publish all the fields on the next update, after the entities were updated by other means."""
+        self._changes.reset()
+
     @property
     def hostname(self):
         """Hostname."""
@@ -396,7 +742,7 @@ class LGDevice:
     @property
     def serial_number(self):
         """Serial number (UUID)."""
-        return self._serial_number
+        return self._data.serial_number
 
     @property
     def port(self):
@@ -410,23 +756,14 @@ class LGDevice:
 
     @property
     def play_state(self):
-        if self._stream_type == 0:
-            return States.UNKNOWN
-        if self._play_control == 1:
-            return States.PAUSED
-        return States.PLAYING
+        """Play state of the current stream."""
+        return self._data.play_state
 
 
     @property
     def state(self) -> States:
         """State of the device."""
-        if not self._power_state:
-            self._state = States.OFF
-        else:
-            self._state = States.ON
-        if self.play_state != States.UNKNOWN:
-            return self.play_state
-        return self._state
+        return self._data.state
 
     @property
     def name(self):
@@ -436,31 +773,32 @@ class LGDevice:
     @property
     def device_name(self):
         """Device name."""
-        return self._device_name
+        return self._data.device_name
 
     @property
     def volume(self):
         """Current volume."""
-        if self._volume_max - self._volume_min == 0:
-            return 0
-        return 100 * abs((self._volume - self._volume_min) / (self._volume_max - self._volume_min))
+        return self._data.volume_level
 
     @property
     def muted(self):
         """Muted."""
-        return self._mute
+        return self._data.mute
 
     @property
     def source(self):
         """Return the current input source."""
-        if self._function == -1 or self._function >= len(functions):
-            return None
-        return functions[self._function]
+        return self._data.source
 
     @property
     def source_list(self) -> list[str]:
         """List of available input sources."""
-        return sorted(functions[function] for function in self._functions if function < len(functions))
+        return self._data.source_list
+
+    @property
+    def available(self) -> bool:
+        """Return False if the device stopped responding or couldn't be connected."""
+        return self._available
 
     @property
     def is_on(self):
@@ -470,107 +808,135 @@ class LGDevice:
     @property
     def sound_mode(self):
         """Return the current sound mode."""
-        if self._equaliser == -1 or self._equaliser >= len(equalisers):
-            return None
-        return equalisers[self._equaliser]
+        return self._data.sound_mode
 
     @property
     def sound_mode_list(self):
         """Return the available sound modes."""
-        return sorted(equalisers[equaliser] for equaliser in self._equalisers if equaliser < len(equalisers))
+        return self._data.sound_mode_list
 
     @property
     def media_artist(self):
         """Current artist."""
-        return self._media_artist
+        return self._data.media_artist
 
     @property
     def media_title(self):
         """Current title."""
-        return self._media_title
+        return self._data.media_title
 
     @property
     def media_image_url(self):
         """Current media image."""
-        return self._media_artwork
+        return self._data.media_artwork
 
     @property
     def media_position(self):
         """Current media position."""
-        return self._media_position
+        return self._data.media_position
 
     @property
     def media_duration(self):
         """Current media duration."""
-        return self._media_duration
+        return self._data.media_duration
 
     @cmd_wrapper
     async def toggle(self):
         """Toggle on or off."""
-        if self.state == States.OFF:
-            self._device.power(True)
-        else:
-            self._device.power(False)
+        power = self.state == States.OFF
+        self._device.power(power)
+        self._expect(power_state=power)
 
     @cmd_wrapper
     async def turn_on(self):
         """Turn on."""
         self._device.power(True)
+        self._expect(power_state=True)
 
     @cmd_wrapper
     async def turn_off(self):
         """Turn off."""
         self._device.power(False)
+        self._expect(power_state=False)
 
     @cmd_wrapper
     async def select_source(self, source: str):
         """Set volume level, range 0..100."""
-        if source is None:
+        if source not in function_ids:
             return ucapi.StatusCodes.BAD_REQUEST
-        self._device.set_func(functions.index(source))
+        self._device.set_func(function_ids[source])
+        self._expect(function=function_ids[source])
 
     @cmd_wrapper
     async def select_sound_mode(self, sound_mode: str) -> None:
         """Set Sound Mode for Receiver.."""
-        self._device.set_eq(equalisers.index(sound_mode))
+        if sound_mode not in equaliser_ids:
+            return ucapi.StatusCodes.BAD_REQUEST
+        self._device.set_eq(equaliser_ids[sound_mode])
+        self._expect(equaliser=equaliser_ids[sound_mode])
 
     @cmd_wrapper
     async def set_volume_level(self, volume: float | None):
         """Set volume level, range 0..100."""
         if volume is None:
             return ucapi.StatusCodes.BAD_REQUEST
-        target_volume = volume * (self._volume_max - self._volume_min) / 100 + self._volume_min
-        self._device.set_volume(int(target_volume))
-        self._volume = target_volume
-        self.events.emit(Events.UPDATE, self.id, {Attributes.VOLUME: self.volume})
-        # await self.update_volume()
+        state = self._data
+        self._set_volume(volume * (state.volume_max - state.volume_min) / 100 + state.volume_min)
 
     @cmd_wrapper
     async def volume_up(self):
         """Send volume-up command to AVR."""
-        volume = self._volume + self._volume_step * (self._volume_max - self._volume_min) / 100
-        volume = min(volume, self._volume_max)
-        self._device.set_volume(int(volume))
-        self._volume = volume
-        self.events.emit(Events.UPDATE, self.id, {Attributes.VOLUME: self.volume})
-        # await self.update_volume()
+        state = self._data
+        volume = state.volume + self._volume_step * (state.volume_max - state.volume_min) / 100
+        self._set_volume(min(volume, state.volume_max))
 
     @cmd_wrapper
     async def volume_down(self):
         """Send volume-down command to AVR."""
-        volume = self._volume - self._volume_step * (self._volume_max - self._volume_min) / 100
-        volume = max(volume, self._volume_min)
-        self._device.set_volume(int(volume))
-        self._volume = volume
-        self.events.emit(Events.UPDATE, self.id, {Attributes.VOLUME: self.volume})
-        # await self.update_volume()
+        state = self._data
+        volume = state.volume - self._volume_step * (state.volume_max - state.volume_min) / 100
+        self._set_volume(max(volume, state.volume_min))
+
+    def _set_volume(self, volume: float) -> None:
+        """
+        Set the target volume.
+
+        The device is updated at most once per volume window: a change within the window of the previous one only
+        updates the target, which is sent at the end of the window with a single entity update.
+        """
+        state = self._data
+        if self._volume_task is None and time.monotonic() - self._volume_sent >= self._volume_window:
+            self._device.set_volume(int(volume))
+            self._volume_sent = time.monotonic()
+            state.volume = volume
+            state.update_derived()
+            self._schedule_snapshot(("volume",))
+            self._emit_update()
+            return
+        state.volume = volume
+        state.update_derived()
+        self._schedule_snapshot(("volume",))
+        if self._volume_task is None:
+            delay = self._volume_sent + self._volume_window - time.monotonic()
+            self._volume_task = self._event_loop.create_task(self._send_volume(delay))
+
+    async def _send_volume(self, delay: float) -> None:
+        await asyncio.sleep(delay)
+        self._volume_task = None
+        try:
+            self._device.set_volume(int(self._data.volume))
+        except TemescalError as ex:
+            _LOGGER.warning("Volume change of %s not sent: %r", self.id, ex)
+            return
+        self._volume_sent = time.monotonic()
+        self._emit_update()
 
     @cmd_wrapper
     async def mute(self, muted: bool):
         """Send mute command to AVR."""
         _LOGGER.debug("Sending mute: %s", muted)
         self._device.set_mute(muted)
-        self.events.emit(Events.UPDATE, self.id, {Attributes.MUTED: muted})
+        self._expect(mute=muted)
         # await self.update_volume()
 
     @cmd_wrapper
@@ -579,68 +945,56 @@ class LGDevice:
         mute = not self.muted
         _LOGGER.debug("Sending mute: %s", mute)
         self._device.set_mute(mute)
-        self.events.emit(Events.UPDATE, self.id, {Attributes.MUTED: mute})
+        self._expect(mute=mute)
         # await self.update_volume()
 
     def check_source(self, source_id) -> bool:
-        if source_id not in self._functions:
-            self._functions.append(source_id)
+        """Add the given source to the list of sources if missing, return True if it was added."""
+        if source_id not in self._data.functions:
+            self._data.functions = [*self._data.functions, source_id]
+            self._data.update_derived(("functions",))
             return True
         return False
 
     @cmd_wrapper
     async def source_next(self):
         """Send next input source command to AVR."""
-        if self._function == -1 or self._function >= len(functions):
-            _LOGGER.debug("Not available to select next source: %s", self._function)
-            return
+        state = self._data
         sources = self.source_list
+        if state.source is None or not sources:
+            _LOGGER.debug("Not available to select next source: %s", state.function)
+            return
         try:
             index = sources.index(self.source)
         except ValueError:
             index = 0
-        try:
-            index += 1
-            if index >= len(sources):
-                index = 0
-            self._function = functions.index(sources[index])
-            self._device.set_func(self._function)
-            self._device.get_func()
-        except ValueError:
-            _LOGGER.warning("Error select next source: %s", self._function)
-            pass
+        # The source list is made of the names of the functions
+        function = function_ids[sources[(index + 1) % len(sources)]]
+        self._device.set_func(function)
+        self._expect(function=function)
 
     @cmd_wrapper
     async def send_command(self, command):
         """Send a command to the device."""
-        if command == "MODE_NIGHT":
-            self._device.set_night_mode(not self._night_mode)
-        elif command == "MODE_AUTO_VOLUME_CONTROL":
-            self._device.set_avc(not self._auto_volume_control)
-        elif command == "MODE_DYNAMIC_RANGE_COMPRESSION":
-            self._device.set_drc(not self._dynamic_range_reduction)
-        elif command == "MODE_NEURALX":
-            self._device.set_neuralx(not self._neural_x)
-        elif command == "MODE_TV_REMOTE":
-            self._device.set_tv_remote(not self._tv_remote)
-        elif command == "MODE_AUTO_DISPLAY":
-            self._device.set_auto_display(not self._auto_display)
+        # pylint: disable = R0911
+        if command in _MODE_COMMANDS:
+            name, setter = _MODE_COMMANDS[command]
+            value = not getattr(self._data, name)
+            setter(self._device, value)
+            self._expect(**{name: value})
         elif command == "INPUT_NEXT":
-            await self.source_next()
+            return await self.source_next()
         elif command == Commands.ON:
-            self._device.power(True)
+            return await self.turn_on()
         elif command == Commands.OFF:
-            self._device.power(False)
+            return await self.turn_off()
         elif command == Commands.TOGGLE:
-            if self.state == States.OFF:
-                self._device.power(False)
-            else:
-                self._device.power(True)
+            return await self.toggle()
         elif command == Commands.VOLUME_UP:
-            await self.volume_up()
+            return await self.volume_up()
         elif command == Commands.VOLUME_DOWN:
-            await self.volume_down()
+            return await self.volume_down()
         elif command == Commands.MUTE:
-            await self.mute_toggle()
+            return await self.mute_toggle()
         # Not needed
         # await self.update()
@@ -9,14 +9,16 @@ import dataclasses
 import json
 import logging
 import os
+import re
 from dataclasses import dataclass
-from typing import Iterator
+from typing import Any, Iterator
 
 from ucapi import EntityTypes
 
 _LOG = logging.getLogger(__name__)
 
 _CFG_FILENAME = "config.json"
+_SNAPSHOT_FILENAME = "state_{}.json"
 
 
 def create_entity_id(device_id: str, entity_type: EntityTypes) -> str:
@@ -40,15 +42,37 @@ def device_from_entity_id(entity_id: str) -> str | None:
 class DeviceInstance:
     """LG Soundbar device configuration."""
 
-    # pylint: disable = W0622
+    # pylint: disable = W0622, R0917
     id: str
     name: str
     address: str
     port: int
     volume_step: float
     always_on: bool
-
-    def __init__(self, id, name, address, port, volume_step, always_on):
+    poll_intervals: dict[str, float] | None
+    volume_window: float | None
+    send_queue: dict[str, Any] | None
+    connect_timeout: float | None
+    liveness_interval: float | None
+    position_interval: float | None
+    update_window: float | None
+
+    def __init__(
+        self,
+        id,
+        name,
+        address,
+        port,
+        volume_step,
+        always_on,
+        poll_intervals=None,
+        volume_window=None,
+        send_queue=None,
+        connect_timeout=None,
+        liveness_interval=None,
+        position_interval=None,
+        update_window=None,
+    ):
         """Initialize a config device instance."""
         self.id = id
         self.name = name
@@ -56,6 +80,13 @@ class DeviceInstance:
         self.port = port
         self.volume_step = volume_step
         self.always_on = always_on
+        self.poll_intervals = poll_intervals
+        self.volume_window = volume_window
+        self.send_queue = send_queue
+        self.connect_timeout = connect_timeout
+        self.liveness_interval = liveness_interval
+        self.position_interval = position_interval
+        self.update_window = update_window
 
 
 class _EnhancedJSONEncoder(json.JSONEncoder):
@@ -89,6 +120,10 @@ class Devices:
         """Return the configuration path."""
         return self._data_path
 
+    def snapshot_path(self, device_id: str) -> str:
+        """Return the path of the state snapshot file of the given device, next to the configuration file."""
+        return os.path.join(self._data_path, _SNAPSHOT_FILENAME.format(re.sub(r"[^\w.-]", "_", device_id)))
+
     def all(self) -> Iterator[DeviceInstance]:
         """Get an iterator for all device configurations."""
         return iter(self._config)
@@ -147,6 +182,7 @@ class Devices:
             return False
         try:
             self._config.remove(device)
+            self._remove_snapshot(device_id)
             if self._remove_handler is not None:
                 self._remove_handler(device)
             return True
@@ -154,8 +190,18 @@ class Devices:
             pass
         return False
 
+    def _remove_snapshot(self, device_id: str) -> None:
+        try:
+            os.remove(self.snapshot_path(device_id))
+        except FileNotFoundError:
+            pass
+        except OSError as ex:
+            _LOG.warning("Cannot remove the state snapshot of %s: %s", device_id, ex)
+
     def clear(self) -> None:
         """Remove the configuration file."""
+        for device in self._config:
+            self._remove_snapshot(device.id)
         self._config = []
 
         if os.path.exists(self._cfg_file_path):
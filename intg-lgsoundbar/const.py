@@ -16,6 +16,44 @@ from ucapi.ui import Buttons, DeviceButtonMapping, UiPage
 SCAN_INTERVAL = timedelta(seconds=10)
 DEFAULT_NAME = "lgsoundbar"
 
+# Polling interval of PLAY_INFO while a stream is playing
+POLL_INTERVAL_PLAYING = 3
+# Polling of a message type is slowed down by this factor while the device pushes it
+POLL_PUSH_BACKOFF = 4
+POLL_MIN_DELAY = 1
+# Delay in seconds between the polls of two devices
+POLL_SPACING = 0.2
+# Interval in seconds between two logs of the statistics of a device, at debug level
+STATS_LOG_INTERVAL = 300
+
+# Timeout in seconds of a connection attempt
+CONNECT_TIMEOUT = 5
+# Maximum delay in seconds between two automatic connection attempts
+CONNECT_BACKOFF_MAX = 60
+# Maximum time in seconds to connect and synchronize a device at startup
+DEVICE_SYNC_TIMEOUT = 10
+# Maximum time in seconds to reconnect before resending a command
+COMMAND_RECONNECT_TIMEOUT = 5
+# Idle time in seconds after which the device is probed, the connection is declared dead after the probe timeout
+LIVENESS_INTERVAL = 15
+LIVENESS_TIMEOUT = 3
+# Delay in seconds before saving the state snapshot of a device after a change, groups successive changes
+SNAPSHOT_DELAY = 5
+# Minimum delay in seconds between two volume changes sent to the device, the steps in between are coalesced
+VOLUME_WINDOW = 0.2
+# Interval in seconds between two media position updates while playing, the remote extrapolates the position between
+POSITION_INTERVAL = 30
+# Difference in seconds between the reported and the extrapolated media position handled as a seek
+POSITION_SEEK_TOLERANCE = 3
+# Time in seconds for the device to report the change of a command, the change published at once is rolled back after
+OPTIMISTIC_TIMEOUT = 5
+# Window in seconds merging the state updates of a device into a single entity update, 0 merges those of a loop cycle
+UPDATE_WINDOW = 0.02
+# Maximum time in seconds to send an event to a WebSocket client, and maximum number of events queued for a client,
+# slower clients are disconnected
+BROADCAST_TIMEOUT = 5
+BROADCAST_QUEUE_SIZE = 100
+
 LG_SIMPLE_COMMANDS = [
     "INPUT_NEXT",
     "MODE_NIGHT",
@@ -10,6 +10,7 @@ import asyncio
 import json
 import logging
 import os
+import time
 from typing import Any
 
 import client
@@ -22,9 +23,14 @@ import ucapi.api_definitions as uc
 import websockets
 from client import LGDevice
 from config import device_from_entity_id
+from const import BROADCAST_QUEUE_SIZE, BROADCAST_TIMEOUT, DEVICE_SYNC_TIMEOUT
 from ucapi.api import IntegrationAPI, filter_log_msg_data
 from ucapi.media_player import Attributes as MediaAttr, States
-from ucapi.media_player import MediaType
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 _LOG = logging.getLogger("driver")  # avoid having __main__ in log messages
 _LOOP = asyncio.get_event_loop()
@@ -34,6 +40,7 @@ api = ucapi.IntegrationAPI(_LOOP)
 # Map of device_id -> Orange instance
 _configured_devices: dict[str, LGDevice] = {}
 _R2_IN_STANDBY = False
+_BACKGROUND_TASKS: set[asyncio.Task] = set()
 
 
 @api.listens_to(ucapi.Events.CONNECT)
@@ -42,9 +49,7 @@ async def on_r2_connect_cmd() -> None:
     # TODO check if we were in standby and ignore the call? We'll also get an EXIT_STANDBY
     _LOG.debug("R2 connect command: connecting device(s)")
     await api.set_device_state(ucapi.DeviceStates.CONNECTED)
-    for device in _configured_devices.values():
-        # start background task
-        await device.connect()
+    await _connect_devices("Connect")
 
 
 @api.listens_to(ucapi.Events.DISCONNECT)
@@ -79,10 +84,34 @@ async def on_r2_exit_standby() -> None:
 
     _R2_IN_STANDBY = False
     _LOG.debug("Exit standby event: connecting device(s)")
+    await _connect_devices("Exit standby")
 
-    for device in _configured_devices.values():
-        # start background task
-        await device.connect()
+
+async def _connect_devices(reason: str) -> None:
+    """Connect and synchronize all configured devices concurrently, and report the time taken by each one."""
+    devices = list(_configured_devices.values())
+    if not devices:
+        return
+    start = time.monotonic()
+    results = await asyncio.gather(*(_connect_device(device) for device in devices))
+    _LOG.info(
+        "%s: %d device(s) synchronized in %.2fs (%s)",
+        reason,
+        len(devices),
+        time.monotonic() - start,
+        ", ".join(f"{device_id} {result} {duration:.2f}s" for device_id, result, duration in results),
+    )
+
+
+async def _connect_device(device: LGDevice) -> tuple[str, str, float]:
+    """Connect and synchronize a device within DEVICE_SYNC_TIMEOUT, return its identifier, result and duration."""
+    start = time.monotonic()
+    try:
+        async with asyncio.timeout(DEVICE_SYNC_TIMEOUT):
+            result = "ok" if await device.connect() else "failed"
+    except TimeoutError:
+        result = "timeout"
+    return device.id, result, time.monotonic() - start
 
 
 @api.listens_to(ucapi.Events.SUBSCRIBE_ENTITIES)
@@ -179,10 +208,14 @@ async def on_device_connected(device_id: str):
                     entity_id, {ucapi.remote.Attributes.STATE: ucapi.remote.States.OFF}
                 )
 
+    await on_avr_update(device_id, publish_all=True)
+
 
 async def on_device_disconnected(avr_id: str):
-    """Handle AVR disconnection."""
+    """Handle AVR disconnection, the integration is disconnected when no device is available anymore."""
     _LOG.debug("AVR disconnected: %s", avr_id)
+    if avr_id in _configured_devices:
+        _configured_devices[avr_id].reset_published()
 
     for entity_id in _entities_from_device(avr_id):
         configured_entity = api.configured_entities.get(entity_id)
@@ -198,8 +231,9 @@ async def on_device_disconnected(avr_id: str):
                 entity_id, {ucapi.remote.Attributes.STATE: ucapi.remote.States.UNAVAILABLE}
             )
 
-    # TODO #20 when multiple devices are supported, the device state logic isn't that simple anymore!
-    await api.set_device_state(ucapi.DeviceStates.DISCONNECTED)
+    # The other soundbars may still be available, only their entities are updated
+    if not any(device.available for device in _configured_devices.values()):
+        await api.set_device_state(ucapi.DeviceStates.DISCONNECTED)
 
 
 async def on_avr_connection_error(avr_id: str, message):
@@ -233,39 +267,30 @@ async def handle_avr_address_change(avr_id: str, address: str) -> None:
         config.devices.update(device)
 
 
-async def on_avr_update(device_id: str, update: dict[str, Any] | None) -> None:
+async def on_avr_update(device_id: str, publish_all: bool = False) -> None:
     """
-    Update attributes of configured media-player entity if device properties changed.
+    Update attributes of configured entities with the device state fields changed since the last update.
 
     :param device_id: AVR identifier
-    :param update: dictionary containing the updated properties or None if
+    :param publish_all: True to publish all the fields, after the entities were updated by other means
     """
-    if update is None:
-        if device_id not in _configured_devices:
-            return
-        device = _configured_devices[device_id]
-        update = {
-            MediaAttr.STATE: device.state,
-            MediaAttr.MEDIA_POSITION: device.media_position,
-            MediaAttr.MEDIA_DURATION: device.media_duration,
-            MediaAttr.MEDIA_TYPE: MediaType.VIDEO,
-        }
-    else:
-        _LOG.info("[%s] LG soundbar update: %s", device_id, update)
-
-    attributes = None
+    device = _configured_devices.get(device_id)
+    if device is None:
+        return
+    if publish_all:
+        device.reset_published()
+    fields = device.published_changes()
+    if not fields:
+        return
+    if _LOG.isEnabledFor(logging.DEBUG):
+        _LOG.debug("[%s] LG soundbar update: %s", device_id, fields)
 
-    # TODO awkward logic: this needs better support from the integration library
     for entity_id in _entities_from_device(device_id):
         configured_entity = api.configured_entities.get(entity_id)
         if configured_entity is None:
-            return
-
-        if isinstance(configured_entity, media_player.LGMediaPlayer):
-            attributes = configured_entity.filter_changed_attributes(update)
-        elif isinstance(configured_entity, remote.LGRemote):
-            attributes = configured_entity.filter_changed_attributes(update)
+            continue
 
+        attributes = configured_entity.changed_attributes(device.data, fields)
         if attributes:
             api.configured_entities.update_attributes(entity_id, attributes)
 
@@ -295,9 +320,14 @@ def _configure_new_device(device_config: config.DeviceInstance, connect: bool =
     if device_config.id in _configured_devices:
         device = _configured_devices[device_config.id]
     else:
-        device = LGDevice(device_config)
+        snapshot_path = config.devices.snapshot_path(device_config.id) if config.devices else None
+        device = LGDevice(device_config, snapshot_path=snapshot_path)
+        # Entities are registered with the lists and the state known from the last run
+        if device.load_snapshot():
+            _LOG.debug("Restored the state snapshot of %s", device_config.id)
 
         device.events.on(client.Events.CONNECTED, on_device_connected)
+        device.events.on(client.Events.DISCONNECTED, on_device_disconnected)
         device.events.on(client.Events.ERROR, on_avr_connection_error)
         device.events.on(client.Events.UPDATE, on_avr_update)
         # receiver.events.on(avr.Events.IP_ADDRESS_CHANGED, handle_avr_address_change)
@@ -352,34 +382,92 @@ def on_device_removed(device: config.DeviceInstance | None) -> None:
 async def _async_remove(device: LGDevice) -> None:
     """Disconnect from receiver and remove all listeners."""
     # await device.disconnect()
+    device.discard_snapshot()
     device.events.remove_all_listeners()
 
 
+def _json_dumps(data: dict[str, Any]) -> str:
+    """Encode a message with orjson if it is installed, the attribute names are str enums."""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode()  # pylint: disable=E1101
+    return json.dumps(data)
+
+
+class _ClientSender:
+    """Events sent to a WebSocket client by a dedicated task, so that a slow client doesn't delay the others."""
+
+    __slots__ = ("websocket", "queue", "sending_since", "task")
+
+    def __init__(self, websocket):
+        """Start the sender task of a client."""
+        self.websocket = websocket
+        self.queue: asyncio.Queue[str] = asyncio.Queue(BROADCAST_QUEUE_SIZE)
+        self.sending_since = 0.0
+        self.task = _LOOP.create_task(self._run())
+
+    def lagging(self, now: float) -> bool:
+        """Return True if the client is too far behind: its queue is full or an event is sent for too long."""
+        return self.queue.full() or 0 < self.sending_since < now - BROADCAST_TIMEOUT
+
+    def disconnect(self) -> None:
+        """Stop sending events and close the connection."""
+        _LOG.warning("[%s] Client too slow to receive events, disconnecting", self.websocket.remote_address)
+        self.task.cancel()
+        # The close handshake of a stalled client can't complete, the connection is aborted after its close timeout
+        task = _LOOP.create_task(self.websocket.close(1013, "Too slow"))
+        _BACKGROUND_TASKS.add(task)
+        task.add_done_callback(_BACKGROUND_TASKS.discard)
+
+    async def _run(self) -> None:
+        try:
+            while True:
+                data_dump = await self.queue.get()
+                self.sending_since = time.monotonic()
+                await self.websocket.send(data_dump)
+                self.sending_since = 0.0
+        except websockets.exceptions.WebSocketException:
+            pass
+
+
+# Map of WebSocket client -> sender, a stopped sender is kept until the client is removed
+_SENDERS: dict[Any, _ClientSender] = {}
+
+
 async def patched_broadcast_ws_event(self, msg: str, msg_data: dict[str, Any], category: uc.EventCategory) -> None:
     """
     Send the given event-message to all connected WebSocket clients.
 
-    If a client is no longer connected, a log message is printed and the remaining
-    clients are notified.
+    The message is encoded once and queued to the sender task of each client. A client whose queue is full, or which
+    doesn't receive an event within BROADCAST_TIMEOUT, is disconnected.
 
     :param msg: event message name
     :param msg_data: message data payload
     :param category: event category
     """
+    # pylint: disable=W0212
+    clients = self._clients
+    # Clients disconnected since the previous event, even if others connected meanwhile
+    for websocket in _SENDERS.keys() - clients:
+        _SENDERS.pop(websocket).task.cancel()
+    if not clients:
+        return
     data = {"kind": "event", "msg": msg, "msg_data": msg_data, "cat": category}
-    data_dump = json.dumps(data)
-    data_log = None
-    # filter fields
+    data_dump = _json_dumps(data)
     if _LOG.isEnabledFor(logging.DEBUG):
-        data_log = json.dumps(data) if filter_log_msg_data(data) else data_dump
-    # pylint: disable=W0212
-    for websocket in self._clients.copy():
-        if _LOG.isEnabledFor(logging.DEBUG):
-            _LOG.debug("[%s] ->: %s", websocket.remote_address, data_log)
-        try:
-            await websocket.send(data_dump)
-        except websockets.exceptions.WebSocketException:
-            pass
+        # filter fields
+        data_log = _json_dumps(data) if filter_log_msg_data(data) else data_dump
+        _LOG.debug("[%s] ->: %s", ", ".join(str(websocket.remote_address) for websocket in clients), data_log)
+    now = time.monotonic()
+    for websocket in clients:
+        sender = _SENDERS.get(websocket)
+        if sender is None:
+            sender = _SENDERS[websocket] = _ClientSender(websocket)
+        elif sender.task.done():
+            continue
+        elif sender.lagging(now):
+            sender.disconnect()
+            continue
+        sender.queue.put_nowait(data_dump)
 
 
 async def main():
@@ -389,6 +477,8 @@ async def main():
     level = os.getenv("UC_LOG_LEVEL", "DEBUG").upper()
     logging.getLogger("client").setLevel(level)
     logging.getLogger("lglib").setLevel(level)
+    logging.getLogger("framing").setLevel(level)
+    logging.getLogger("polling").setLevel(level)
     logging.getLogger("discover").setLevel(level)
     logging.getLogger("driver").setLevel(level)
     logging.getLogger("media_player").setLevel(level)
@@ -402,10 +492,7 @@ async def main():
         _configure_new_device(device, connect=False)
 
     # _LOOP.create_task(receiver_status_poller())
-    for device in _configured_devices.values():
-        if not device.is_on:
-            continue
-        _LOOP.create_task(device.update())
+    _LOOP.create_task(_connect_devices("Startup"))
 
     # pylint: disable=W0212
     IntegrationAPI._broadcast_ws_event = patched_broadcast_ws_event
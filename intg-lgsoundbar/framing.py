@@ -0,0 +1,115 @@
+"""
+Framing codec of the LG soundbar protocol, shared by the sending and receiving sides.
+
+A frame is made of the 0x10 marker, the length of the payload as a big-endian 32-bit integer and the payload, which
+is the JSON message encrypted with AES-CBC after PKCS#7 padding.
+
+:copyright: (c) 2024 by Unfolded Circle ApS.
+:license: Mozilla Public License Version 2.0, see LICENSE for more details.
+"""
+
+import logging
+import struct
+
+from Crypto.Cipher import AES
+
+_LOG = logging.getLogger(__name__)
+
+IV = b"'%^Ur7gy$~t+f)%@"
+KEY = b"T^&*J%^7tr~4^%^&I(o%^!jIJ__+a0 k"
+
+BLOCK_SIZE = 16
+FRAME_MARKER = 0x10
+FRAME_HEADER_SIZE = 5
+MAX_FRAME_SIZE = 1 << 20
+
+_HEADER = struct.Struct(">BI")
+
+
+def pad(data: bytes) -> bytes:
+    """Pad the given bytes to the AES block size (PKCS#7)."""
+    padlen = BLOCK_SIZE - (len(data) % BLOCK_SIZE)
+    return data + bytes((padlen,)) * padlen
+
+
+def unpad(data: bytes) -> bytes:
+    """Remove the PKCS#7 padding of the given bytes."""
+    padlen = data[-1] if data else 0
+    if padlen == 0 or padlen > BLOCK_SIZE or padlen > len(data):
+        raise ValueError(f"Invalid padding length {padlen}")
+    return data[:-padlen]
+
+
+def encrypt(data: str) -> bytes:
+    """Encrypt a message to the payload of a frame."""
+    return AES.new(KEY, AES.MODE_CBC, IV).encrypt(pad(data.encode("utf-8")))
+
+
+def decode_payload(payload: bytes) -> str:
+    """Decrypt the payload of a received frame to the message."""
+    return str(unpad(AES.new(KEY, AES.MODE_CBC, IV).decrypt(payload)), "utf-8")
+
+
+def encode_frame(data: str) -> bytes:
+    """Encrypt a message and wrap it in a frame ready to be sent."""
+    payload = encrypt(data)
+    return _HEADER.pack(FRAME_MARKER, len(payload)) + payload
+
+
+class FrameDecoder:
+    """
+    Incremental decoder of the frames received from the device.
+
+    The socket reads directly into the receive buffer, any number of frames can be extracted from one read and
+    partial frames are kept until the next one. Unexpected bytes are skipped until the next frame marker.
+    """
+
+    def __init__(self, size: int = 4096):
+        """Initialize the receive buffer."""
+        self._buffer = bytearray(size)
+        self._start = 0
+        self._end = 0
+
+    def get_buffer(self, sizehint: int = -1) -> memoryview:
+        """Return the free part of the receive buffer to read into."""
+        needed = max(sizehint, 1024)
+        if len(self._buffer) - self._end < needed:
+            pending = self._end - self._start
+            if len(self._buffer) - pending < needed:
+                buffer = bytearray(max(2 * len(self._buffer), pending + needed))
+                buffer[:pending] = self._buffer[self._start : self._end]
+                self._buffer = buffer
+            else:
+                self._buffer[:pending] = self._buffer[self._start : self._end]
+            self._start = 0
+            self._end = pending
+        return memoryview(self._buffer)[self._end :]
+
+    def buffer_updated(self, nbytes: int) -> list[bytes]:
+        """Account for the bytes read into the buffer and return the complete frame payloads."""
+        self._end += nbytes
+        frames = []
+        buffer = self._buffer
+        while self._start < self._end:
+            if buffer[self._start] != FRAME_MARKER:
+                marker = buffer.find(FRAME_MARKER, self._start, self._end)
+                _LOG.debug("Skipping %d unexpected bytes", (marker if marker >= 0 else self._end) - self._start)
+                if marker < 0:
+                    self._start = self._end
+                    break
+                self._start = marker
+            if self._end - self._start < FRAME_HEADER_SIZE:
+                break
+            _marker, length = _HEADER.unpack_from(buffer, self._start)
+            if length == 0 or length % BLOCK_SIZE != 0 or length > MAX_FRAME_SIZE:
+                # Not a valid frame header, resynchronise on the next marker
+                self._start += 1
+                continue
+            frame_end = self._start + FRAME_HEADER_SIZE + length
+            if frame_end > self._end:
+                break
+            frames.append(bytes(buffer[self._start + FRAME_HEADER_SIZE : frame_end]))
+            self._start = frame_end
+        if self._start == self._end:
+            self._start = self._end = 0
+        return frames
@@ -5,13 +5,17 @@ LG soundbar library handling of the integration driver.
 :license: Mozilla Public License Version 2.0, see LICENSE for more details.
 """
 
+import asyncio
 import json
-import socket
-import struct
 import logging
-from threading import Thread
+import random
+import socket
+import time
+from contextlib import contextmanager
+from functools import lru_cache
 
-from Crypto.Cipher import AES
+from framing import IV, KEY, FrameDecoder, decode_payload, encode_frame
+from outbound import OutboundQueue, Priority
 
 _LOG = logging.getLogger(__name__)
 
@@ -21,6 +25,8 @@ equalisers = ["Standard", "Bass", "Flat", "Boost", "Treble and Bass", "User",
               "DTS Virtual X", "Bass Boost Plus", "DTS X", "AI Sound Pro",
               "Clear Voice", "Sports", "Game"]
 
+equaliser_ids = {name: index for index, name in enumerate(equalisers)}
+
 STANDARD = 0
 BASS = 1
 FLAT = 2
@@ -50,6 +56,8 @@ functions = ["Wi-Fi", "Bluetooth", "Portable", "Aux", "Optical", "CP", "HDMI",
              "Chromecast", "Optical/HDMI ARC", "LG Optical", "FM", "USB", "USB2",
              "E-ARC"]
 
+function_ids = {name: index for index, name in enumerate(functions)}
+
 functions_map = {
     "Optical": "Optical/HDMI ARC",
     "ARC": "Optical/HDMI ARC",
@@ -88,107 +96,358 @@ PLAYING = 0
 PAUSED = 1
 
 
+@lru_cache(maxsize=None)
+def get_request_frame(msg: str) -> bytes:
+    """
+    Return the encoded frame of a get request.
+
+    The IV is fixed, so the frame of a given request is always the same and it is encrypted only once.
+    """
+    return encode_frame(json.dumps({"cmd": "get", "msg": msg}))
+
+
+class TemescalError(Exception):
+    """Error of the connection to the device."""
+
+
+class ConnectionFailedError(TemescalError):
+    """The connection to the device could not be opened."""
+
+
+class NotConnectedError(TemescalError):
+    """The connection to the device is closed, the packet was not sent."""
+
+
+class RequestTimeoutError(TemescalError):
+    """The device did not answer a request in time."""
+
+
+class QueueFullError(TemescalError):
+    """The send queue is full of commands, the packet was dropped."""
+
+
+class _TemescalProtocol(asyncio.BufferedProtocol):
+    """Receiving side of the connection to the device."""
+
+    def __init__(self, temescal: "Temescal"):
+        self._temescal = temescal
+        self._decoder = FrameDecoder()
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        return self._decoder.get_buffer(sizehint)
+
+    def buffer_updated(self, nbytes: int) -> None:
+        for frame in self._decoder.buffer_updated(nbytes):
+            self._temescal.handle_frame(frame)
+
+    def connection_lost(self, exc: Exception | None) -> None:
+        self._temescal.connection_lost(self, exc)
+
+    def pause_writing(self) -> None:
+        self._temescal.pause_writing(self)
+
+    def resume_writing(self) -> None:
+        self._temescal.resume_writing(self)
+
+
 class Temescal:
     """LG library."""
 
-    def __init__(self, address, port=9741, callback=None, logger=None):
-        """Initialize a LG soundbar device."""
-        self.iv = b"'%^Ur7gy$~t+f)%@"
-        self.key = b"T^&*J%^7tr~4^%^&I(o%^!jIJ__+a0 k"
+    # pylint: disable = R0917
+    def __init__(
+        self,
+        address,
+        port=9741,
+        callback=None,
+        logger=None,
+        send_queue: OutboundQueue | None = None,
+        connect_timeout: float = 5,
+        backoff_max: float = 60,
+        keepalive: int = 0,
+    ):
+        """Initialize a LG soundbar device, keepalive is the idle time in seconds before TCP keepalive probes."""
+        self.iv = IV
+        self.key = KEY
         self.address = address
         self.port = port
         self.callback = callback
         self.logger = logger
-        self.socket = None
-        self.connect()
-        if callback is not None:
-            self.thread = Thread(target=self.listen, daemon=True)
-            self.thread.start()
-
-    def connect(self):
-        """Connect to the device."""
-        if self.socket:
+        self._transport: asyncio.Transport | None = None
+        self._protocol: _TemescalProtocol | None = None
+        self._connect_task: asyncio.Task | None = None
+        self._connect_lock = asyncio.Lock()
+        self._queue = send_queue or OutboundQueue()
+        self._paused = False
+        self._batching = False
+        self._drain_timer: asyncio.TimerHandle | None = None
+        self._requests: dict[str, asyncio.Future] = {}
+        self.connect_timeout = connect_timeout
+        self.backoff_max = backoff_max
+        self._next_connect = float("-inf")
+        self.connect_attempts = 0
+        self.connect_failures = 0
+        self.consecutive_failures = 0
+        self.last_connect_duration = 0.0
+        self.max_connect_duration = 0.0
+        self.keepalive = keepalive
+        self.last_received = float("-inf")
+        self.bytes_sent = 0
+        self.writes = 0
+
+    @property
+    def connected(self) -> bool:
+        """Return True if the connection to the device is open."""
+        return self._transport is not None and not self._transport.is_closing()
+
+    @property
+    def send_queue(self) -> OutboundQueue:
+        """Queue of the frames to send."""
+        return self._queue
+
+    @property
+    def connect_stats(self) -> dict[str, float]:
+        """Connection attempts, failures and durations in seconds."""
+        return {
+            "attempts": self.connect_attempts,
+            "failures": self.connect_failures,
+            "consecutive_failures": self.consecutive_failures,
+            "last_duration": self.last_connect_duration,
+            "max_duration": self.max_connect_duration,
+            "backoff": max(0.0, self._next_connect - time.monotonic()),
+        }
+
+    async def connect(self, backoff: bool = True):
+        """
+        Connect to the device, raise ConnectionFailedError on failure.
+
+        The IPv4 and IPv6 addresses of the host are tried in parallel, the attempt fails after connect_timeout seconds.
+        After a failure, the next attempts fail immediately during an exponential backoff with jitter, unless backoff
+        is False.
+        """
+        if self.connected:
             return
-        try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((self.address, self.port))
-        except Exception as ex:
-            _LOG.error("Error while connecting to soundbar", ex)
+        async with self._connect_lock:
+            if self.connected:
+                return
+            if backoff and time.monotonic() < self._next_connect:
+                raise self._connect_failed(ConnectionFailedError(f"Waiting to reconnect to {self.address}:{self.port}"))
+            self.connect_attempts += 1
+            start = time.monotonic()
+            try:
+                async with asyncio.timeout(self.connect_timeout):
+                    self._transport, self._protocol = await asyncio.get_running_loop().create_connection(
+                        lambda: _TemescalProtocol(self), self.address, self.port, happy_eyeballs_delay=0.25
+                    )
+            except (OSError, TimeoutError) as ex:
+                self.last_connect_duration = time.monotonic() - start
+                self.max_connect_duration = max(self.max_connect_duration, self.last_connect_duration)
+                self.connect_failures += 1
+                self.consecutive_failures += 1
+                delay = min(self.backoff_max, 2 ** (self.consecutive_failures - 1)) * random.uniform(0.5, 1)
+                self._next_connect = time.monotonic() + delay
+                _LOG.error(
+                    "Error while connecting to soundbar %s:%s : %r, next attempt in %.1fs",
+                    self.address,
+                    self.port,
+                    ex,
+                    delay,
+                )
+                error = ConnectionFailedError(f"Cannot connect to {self.address}:{self.port}")
+                raise self._connect_failed(error) from ex
+            self.last_connect_duration = time.monotonic() - start
+            self.max_connect_duration = max(self.max_connect_duration, self.last_connect_duration)
+            self.consecutive_failures = 0
+            self._next_connect = float("-inf")
+            self._paused = False
+            self._set_keepalive()
+            # Flush the packets sent while the connection was down
+            self._drain()
+
+    def _set_keepalive(self):
+        sock = self._transport.get_extra_info("socket")
+        if not self.keepalive or sock is None:
+            return
+        # A half-open connection is closed after about twice the idle time, the options are platform specific
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for option, value in (
+            ("TCP_KEEPIDLE", self.keepalive),
+            ("TCP_KEEPINTVL", max(1, self.keepalive // 3)),
+            ("TCP_KEEPCNT", 3),
+        ):
+            if hasattr(socket, option):
+                sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), value)
+
+    def _connect_failed(self, error: ConnectionFailedError) -> ConnectionFailedError:
+        # The queued frames and the pending requests are dropped, the error is returned to be raised
+        self._queue.clear()
+        self._fail_requests(error)
+        return error
 
     def disconnect(self):
         """Disconnect from the device."""
-        if self.socket:
-            try:
-                self.socket.close()
-            # pylint: disable=W0718
-            except Exception:
-                pass
-            self.socket = None
-
-    def reconnect(self):
+        if self._transport:
+            self._transport.close()
+        self._transport = None
+        self._protocol = None
+        self._queue.reset_in_flight()
+        self._fail_requests(NotConnectedError(f"Disconnected from {self.address}:{self.port}"))
+
+    async def reconnect(self):
         """Reconnect."""
         self.disconnect()
-        self.connect()
+        await self.connect()
 
-    def listen(self):
-        """Listen for device responses."""
-        data = None
-        while True:
+    def connection_lost(self, protocol: _TemescalProtocol, exc: Exception | None):
+        """Handle the connection closed by the device, it will be recreated on next send."""
+        if protocol is not self._protocol:
+            return
+        if exc:
+            _LOG.debug("Connection to soundbar %s lost: %s", self.address, exc)
+        else:
+            _LOG.debug("Soundbar %s closed the connection", self.address)
+        self._transport = None
+        self._protocol = None
+        self._queue.reset_in_flight()
+        self._fail_requests(NotConnectedError(f"Connection to {self.address}:{self.port} lost"))
+
+    def pause_writing(self, protocol: _TemescalProtocol):
+        """Stop sending while the write buffer of the connection is full."""
+        if protocol is self._protocol:
+            self._paused = True
+
+    def resume_writing(self, protocol: _TemescalProtocol):
+        """Send the queued frames once the write buffer of the connection is drained."""
+        if protocol is self._protocol:
+            self._paused = False
+            self._drain()
+
+    def handle_frame(self, data: bytes):
+        """Decrypt a received frame, forward the response to the callback and to the pending request."""
+        try:
+            response = json.loads(self.decrypt_packet(data))
+            msg = response.get("msg")
+        except (ValueError, IndexError, AttributeError) as ex:
+            _LOG.warning("Invalid frame received from soundbar %s: %s", self.address, ex)
+            return
+        self.last_received = time.monotonic()
+        if self._queue.acknowledge(msg):
+            self._drain()
+        if self.callback is not None:
             try:
-                data = self.socket.recv(1)
-            # pylint: disable=W0718
-            except Exception:
-                self.connect()
-
-            if len(data) == 0:  # the soundbar closed the connection, recreate it
-                self.socket.shutdown(socket.SHUT_RDWR)
-                self.socket.close()
-                self.connect()
-                continue
-
-            if data[0] == 0x10:
-                data = self.socket.recv(4)
-                length = struct.unpack(">I", data)[0]
-                data = self.socket.recv(length)
-                if len(data) % 16 != 0:
-                    continue
-                response = self.decrypt_packet(data)
-                if response is not None:
-                    self.callback(json.loads(response))
-
-    def encrypt_packet(self, data):
+                self.callback(response)
+            except Exception as ex:  # pylint: disable=W0718
+                _LOG.exception("Error while handling soundbar response %s: %s", response, ex)
+        # Resolved after the callback, the state is up-to-date when the requester resumes
+        if self._requests and response.get("cmd") == "notibyget":
+            future = self._requests.pop(msg, None)
+            if future is not None and not future.done():
+                future.set_result(response)
+
+    async def request(self, msg: str, timeout: float = 3) -> dict:
+        """
+        Send a get request and return the response of the device.
+
+        Concurrent requests of the same message type share the same response. Raise RequestTimeoutError if the device
+        does not answer within timeout seconds, or another TemescalError if the connection fails.
+        """
+        future = self._requests.get(msg)
+        if future is None or future.done():
+            future = asyncio.get_running_loop().create_future()
+            self._requests[msg] = future
+            self.get(msg)
+        try:
+            async with asyncio.timeout(timeout):
+                return await asyncio.shield(future)
+        except TimeoutError as ex:
+            if self._requests.get(msg) is future:
+                del self._requests[msg]
+            raise RequestTimeoutError(f"No response to {msg} from {self.address}:{self.port}") from ex
+
+    def _fail_requests(self, error: TemescalError):
+        requests, self._requests = self._requests, {}
+        for future in requests.values():
+            if not future.done():
+                future.set_exception(error)
+
+    def encrypt_packet(self, data: str) -> bytes:
         """Encrypt packet to send to the device."""
-        padlen = 16 - (len(data) % 16)
-        for _i in range(padlen):
-            data = data + chr(padlen)
-        data = data.encode("utf-8")
-        cipher = AES.new(self.key, AES.MODE_CBC, self.iv)
-
-        encrypted = cipher.encrypt(data)
-        length = len(encrypted)
-        prelude = bytearray([0x10, 0x00, 0x00, 0x00, length])
-        return prelude + encrypted
-
-    def decrypt_packet(self, data):
+        return encode_frame(data)
+
+    def decrypt_packet(self, data: bytes) -> str:
         """Decrypt received packet."""
-        cipher = AES.new(self.key, AES.MODE_CBC, self.iv)
-        decrypt = cipher.decrypt(data)
-        padding = decrypt[-1:]
-        decrypt = decrypt[: -ord(padding)]
-        return str(decrypt, "utf-8")
-
-    def send_packet(self, data):
-        """Send a packet."""
-        # pylint: disable=W0718
-        packet = self.encrypt_packet(json.dumps(data))
+        return decode_payload(data)
+
+    def send_packet(self, data, key: str | None = None):
+        """
+        Send a command packet, raise NotConnectedError if the connection is closed or QueueFullError if it is dropped.
+
+        A command with the key of a command still queued replaces it.
+        """
+        if not self.send_frame(self.encrypt_packet(json.dumps(data)), Priority.COMMAND, key, queue=False):
+            raise QueueFullError(f"Send queue of {self.address}:{self.port} is full")
+
+    def send_frame(self, packet: bytes, priority: Priority = Priority.POLL, key: str | None = None, queue=True) -> bool:
+        """
+        Send an encoded frame through the send queue, return False if the queue is full and the frame was dropped.
+
+        If the connection is closed, the frame is queued and the connection reopened in the background, or
+        NotConnectedError is raised if queue is False.
+        """
+        if not queue and not self.connected:
+            raise NotConnectedError(f"Not connected to {self.address}:{self.port}")
+        if not self._queue.put(packet, priority, key):
+            return False
+        if self.connected:
+            self._drain()
+        elif self._connect_task is None or self._connect_task.done():
+            self._connect_task = asyncio.get_running_loop().create_task(self._connect_background())
+        return True
+
+    async def _connect_background(self):
         try:
-            self.socket.send(packet)
-        except Exception:
-            try:
-                self.connect()
-                self.socket.send(packet)
-            except Exception:
-                pass
+            await self.connect()
+        except TemescalError:
+            pass
+
+    @contextmanager
+    def batch(self):
+        """Coalesce the packets sent within the context into a single write."""
+        if self._batching:
+            yield
+            return
+        self._batching = True
+        try:
+            yield
+        finally:
+            self._batching = False
+            self._drain()
+
+    def _drain(self):
+        """Write the frames of the send queue which can be sent now in a single write."""
+        if self._batching or self._paused or not self.connected:
+            return
+        frames = self._queue.pop_ready(time.monotonic())
+        if frames:
+            self._write(frames[0] if len(frames) == 1 else b"".join(frames))
+        # Polls waiting for the responses of the previous ones are sent at the latest when these expire
+        blocked_until = self._queue.blocked_until()
+        if blocked_until is not None and self._drain_timer is None:
+            self._drain_timer = asyncio.get_running_loop().call_later(
+                max(0.0, blocked_until - time.monotonic()), self._drain_timer_expired
+            )
+
+    def _drain_timer_expired(self):
+        self._drain_timer = None
+        self._drain()
+
+    def _write(self, data: bytes):
+        self._transport.write(data)
+        self.writes += 1
+        self.bytes_sent += len(data)
+
+    def get(self, msg: str):
+        """Send a get request for the given message type, a request already queued is not repeated."""
+        self.send_frame(get_request_frame(msg), Priority.POLL, msg)
 
     def power(self, value: bool):
         """Power command."""
@@ -197,8 +456,7 @@ class Temescal:
 
     def get_eq(self):
         """Get equalizer settings."""
-        data = {"cmd": "get", "msg": "EQ_VIEW_INFO"}
-        self.send_packet(data)
+        self.get("EQ_VIEW_INFO")
 
     def set_eq(self, eq):
         """Set equalizer settings."""
@@ -207,73 +465,59 @@ class Temescal:
 
     def get_info(self):
         """Get information."""
-        data = {"cmd": "get", "msg": "SPK_LIST_VIEW_INFO"}
-        self.send_packet(data)
+        self.get("SPK_LIST_VIEW_INFO")
 
     def get_play(self):
         """Get play state."""
-        data = {"cmd": "get", "msg": "PLAY_INFO"}
-        self.send_packet(data)
+        self.get("PLAY_INFO")
 
     def get_func(self):
         """Get functions information."""
-        data = {"cmd": "get", "msg": "FUNC_VIEW_INFO"}
-        self.send_packet(data)
+        self.get("FUNC_VIEW_INFO")
 
     def get_settings(self):
         """Get settings information."""
-        data = {"cmd": "get", "msg": "SETTING_VIEW_INFO"}
-        self.send_packet(data)
+        self.get("SETTING_VIEW_INFO")
 
     def get_product_info(self):
         """Get product information."""
-        data = {"cmd": "get", "msg": "PRODUCT_INFO"}
-        self.send_packet(data)
+        self.get("PRODUCT_INFO")
 
     def get_c4a_info(self):
         """Get C4A_SETTING_INFO."""
-        data = {"cmd": "get", "msg": "C4A_SETTING_INFO"}
-        self.send_packet(data)
+        self.get("C4A_SETTING_INFO")
 
     def get_radio_info(self):
         """Get radio information."""
-        data = {"cmd": "get", "msg": "RADIO_VIEW_INFO"}
-        self.send_packet(data)
+        self.get("RADIO_VIEW_INFO")
 
     def get_ap_info(self):
         """Get app information."""
-        data = {"cmd": "get", "msg": "SHARE_AP_INFO"}
-        self.send_packet(data)
+        self.get("SHARE_AP_INFO")
 
     def get_update_info(self):
         """Get update information."""
-        data = {"cmd": "get", "msg": "UPDATE_VIEW_INFO"}
-        self.send_packet(data)
+        self.get("UPDATE_VIEW_INFO")
 
     def get_build_info(self):
         """Get build information."""
-        data = {"cmd": "get", "msg": "BUILD_INFO_DEV"}
-        self.send_packet(data)
+        self.get("BUILD_INFO_DEV")
 
     def get_option_info(self):
         """Get options information."""
-        data = {"cmd": "get", "msg": "OPTION_INFO_DEV"}
-        self.send_packet(data)
+        self.get("OPTION_INFO_DEV")
 
     def get_mac_info(self):
         """Get mac information."""
-        data = {"cmd": "get", "msg": "MAC_INFO_DEV"}
-        self.send_packet(data)
+        self.get("MAC_INFO_DEV")
 
     def get_mem_mon_info(self):
         """Get memory monitoring information."""
-        data = {"cmd": "get", "msg": "MEM_MON_DEV"}
-        self.send_packet(data)
+        self.get("MEM_MON_DEV")
 
     def get_test_info(self):
         """Get test information."""
-        data = {"cmd": "get", "msg": "TEST_DEV"}
-        self.send_packet(data)
+        self.get("TEST_DEV")
 
     def test_tone(self):
         """Get test tone."""
@@ -368,7 +612,7 @@ class Temescal:
     def set_volume(self, value):
         """Set volume."""
         data = {"cmd": "set", "data": {"i_vol": value}, "msg": "SPK_LIST_VIEW_INFO"}
-        self.send_packet(data)
+        self.send_packet(data, "SPK_LIST_VIEW_INFO.i_vol")
 
     def set_mute(self, enable):
         """Set mute."""
@@ -6,11 +6,12 @@ Media-player entity functions.
 """
 
 import logging
-from typing import Any
+from typing import Any, Collection
 
 from client import LGDevice
 from config import DeviceInstance, create_entity_id
 from const import LG_SIMPLE_COMMANDS
+from state import DeviceState
 from ucapi import EntityTypes, MediaPlayer, StatusCodes
 from ucapi.media_player import (
     Attributes,
@@ -24,6 +25,23 @@ from ucapi.media_player import (
 
 _LOG = logging.getLogger(__name__)
 
+# Device state field -> media-player attribute, None values are published as empty strings
+_STATE_ATTRIBUTES = {
+    "state": Attributes.STATE,
+    "volume_level": Attributes.VOLUME,
+    "mute": Attributes.MUTED,
+    "source": Attributes.SOURCE,
+    "source_list": Attributes.SOURCE_LIST,
+    "sound_mode": Attributes.SOUND_MODE,
+    "sound_mode_list": Attributes.SOUND_MODE_LIST,
+    "media_artwork": Attributes.MEDIA_IMAGE_URL,
+    "media_position": Attributes.MEDIA_POSITION,
+    "media_duration": Attributes.MEDIA_DURATION,
+    "media_title": Attributes.MEDIA_TITLE,
+    "media_artist": Attributes.MEDIA_ARTIST,
+}
+_MEDIA_FIELDS = ("media_artwork", "media_position", "media_duration", "media_title", "media_artist")
+
 
 class LGMediaPlayer(MediaPlayer):
     """Representation of a Sony Media Player entity."""
@@ -130,71 +148,37 @@ class LGMediaPlayer(MediaPlayer):
             return await self._device.send_command(cmd_id)
         return StatusCodes.NOT_IMPLEMENTED
 
-    def filter_changed_attributes(self, update: dict[str, Any]) -> dict[str, Any]:
+    def changed_attributes(self, state: DeviceState, fields: Collection[str]) -> dict[str, Any]:
         """
-        Filter the given attributes and return only the changed values.
+        Return the attributes of the given changed fields of the device state.
 
-        :param update: dictionary with attributes.
-        :return: filtered entity attributes containing changed attributes only.
+        :param state: device state.
+        :param fields: changed fields of the device state.
+        :return: entity attributes of the changed fields.
         """
         attributes = {}
+        for name in fields:
+            attribute = _STATE_ATTRIBUTES.get(name)
+            if attribute is not None:
+                value = getattr(state, name)
+                attributes[attribute] = "" if value is None else value
 
-        if Attributes.STATE in update:
-            state = update[Attributes.STATE]
-            attributes = self._key_update_helper(Attributes.STATE, state, attributes)
-
-        for attr in [
-            Attributes.VOLUME,
-            Attributes.MUTED,
-            Attributes.SOURCE,
-            Attributes.SOURCE_LIST,
-            Attributes.SOUND_MODE,
-            Attributes.SOUND_MODE_LIST,
-            Attributes.MEDIA_TYPE,
-            Attributes.MEDIA_IMAGE_URL,
-            Attributes.MEDIA_POSITION,
-            Attributes.MEDIA_DURATION,
-            Attributes.MEDIA_TITLE,
-            Attributes.MEDIA_ARTIST,
-        ]:
-            if attr in update:
-                attributes = self._key_update_helper(attr, update[attr], attributes)
-
-        if Attributes.SOURCE_LIST in update:
-            if Attributes.SOURCE_LIST in self.attributes:
-                if update[Attributes.SOURCE_LIST] != self.attributes[Attributes.SOURCE_LIST]:
-                    attributes[Attributes.SOURCE_LIST] = update[Attributes.SOURCE_LIST]
-
-        if Features.SELECT_SOUND_MODE in self.features:
-            if Attributes.SOUND_MODE in update:
-                attributes = self._key_update_helper(Attributes.SOUND_MODE, update[Attributes.SOUND_MODE], attributes)
-            if Attributes.SOUND_MODE_LIST in update:
-                if Attributes.SOUND_MODE_LIST in self.attributes:
-                    if update[Attributes.SOUND_MODE_LIST] != self.attributes[Attributes.SOUND_MODE_LIST]:
-                        attributes[Attributes.SOUND_MODE_LIST] = update[Attributes.SOUND_MODE_LIST]
-
-        if Attributes.STATE in attributes:
-            if attributes[Attributes.STATE] == States.OFF:
-                attributes[Attributes.MEDIA_IMAGE_URL] = ""
-                attributes[Attributes.MEDIA_ALBUM] = ""
-                attributes[Attributes.MEDIA_ARTIST] = ""
-                attributes[Attributes.MEDIA_TITLE] = ""
-                attributes[Attributes.MEDIA_TYPE] = ""
-                attributes[Attributes.SOURCE] = ""
-
-        _LOG.debug("MediaPlayer update attributes %s -> %s", update, attributes)
-        return attributes
-
-    def _key_update_helper(self, key: str, value: str | None, attributes):
-        # pylint: disable=R0801
-        if value is None:
+        if Attributes.STATE not in attributes:
             return attributes
-
-        if key in self.attributes:
-            if self.attributes[key] != value:
-                attributes[key] = value
+        if attributes[Attributes.STATE] != States.OFF:
+            if self.attributes.get(Attributes.STATE) != States.OFF:
+                return attributes
+            # The media attributes were cleared while off
+            for name in _MEDIA_FIELDS:
+                value = getattr(state, name)
+                attributes[_STATE_ATTRIBUTES[name]] = "" if value is None else value
+            attributes[Attributes.SOURCE] = state.source or ""
+            attributes[Attributes.MEDIA_TYPE] = MediaType.VIDEO
         else:
-            attributes[key] = value
-
+            attributes[Attributes.MEDIA_IMAGE_URL] = ""
+            attributes[Attributes.MEDIA_ALBUM] = ""
+            attributes[Attributes.MEDIA_ARTIST] = ""
+            attributes[Attributes.MEDIA_TITLE] = ""
+            attributes[Attributes.MEDIA_TYPE] = ""
+            attributes[Attributes.SOURCE] = ""
         return attributes
-
@@ -0,0 +1,192 @@
+"""
+Outbound queue of the frames sent to a LG soundbar.
+
+:copyright: (c) 2024 by Unfolded Circle ApS.
+:license: Mozilla Public License Version 2.0, see LICENSE for more details.
+"""
+
+import logging
+from collections import deque
+from dataclasses import dataclass
+from enum import IntEnum, StrEnum
+from typing import Any
+
+_LOG = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Priority of the queued frames, lower values are sent first."""
+
+    COMMAND = 0
+    POLL = 1
+
+
+class OverflowPolicy(StrEnum):
+    """
+    Poll dropped when a frame is added to a full queue, a command always evicts a queued poll first.
+
+    Queued commands are never evicted: when the queue is full of commands, the new frame is dropped so that its sender
+    is told.
+    """
+
+    DROP_OLDEST = "drop_oldest"
+    DROP_NEW = "drop_new"
+
+
+# Option of OutboundQueue -> accepted types, the values must be positive or a policy name
+_OPTION_TYPES: dict[str, type | tuple[type, ...]] = {
+    "max_size": int,
+    "overflow": str,
+    "max_in_flight": int,
+    "in_flight_timeout": (int, float),
+}
+
+
+@dataclass(slots=True)
+class _Item:
+    priority: Priority
+    key: str | None
+    frame: bytes
+
+
+class OutboundQueue:
+    """
+    Bounded priority queue of the frames to send.
+
+    Commands are sent before polls. A frame with the key of a queued frame replaces it, so duplicate polls are
+    collapsed and successive values of a setting merged. Polls are get requests answered with the same message type,
+    at most max_in_flight of them are sent without response, a missing response is ignored after in_flight_timeout.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 32,
+        overflow: OverflowPolicy | str = OverflowPolicy.DROP_OLDEST,
+        max_in_flight: int = 4,
+        in_flight_timeout: float = 5,
+    ):
+        """Create an empty queue."""
+        self.max_size = max_size
+        self.overflow = OverflowPolicy(overflow)
+        self.max_in_flight = max_in_flight
+        self.in_flight_timeout = in_flight_timeout
+        self._queues: dict[Priority, deque[_Item]] = {priority: deque() for priority in Priority}
+        self._keys: dict[str, _Item] = {}
+        self._in_flight: dict[str, float] = {}
+        self.enqueued = 0
+        self.sent = 0
+        self.merged = 0
+        self.dropped = 0
+        self.max_depth = 0
+
+    @property
+    def depth(self) -> int:
+        """Number of queued frames."""
+        return sum(len(queue) for queue in self._queues.values())
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """Queue depth and counters."""
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "in_flight": len(self._in_flight),
+            "enqueued": self.enqueued,
+            "sent": self.sent,
+            "merged": self.merged,
+            "dropped": self.dropped,
+        }
+
+    def put(self, frame: bytes, priority: Priority, key: str | None = None) -> bool:
+        """Queue a frame, return False if it was dropped."""
+        if key is not None and (item := self._keys.get(key)) is not None:
+            item.frame = frame
+            self.merged += 1
+            return True
+        depth = self.depth
+        if depth >= self.max_size:
+            polls = self._queues[Priority.POLL]
+            if not polls or (self.overflow == OverflowPolicy.DROP_NEW and priority == Priority.POLL):
+                self.dropped += 1
+                _LOG.debug("Send queue full, frame %s dropped", key)
+                return False
+            victim = polls.popleft()
+            if victim.key is not None:
+                del self._keys[victim.key]
+            self.dropped += 1
+            _LOG.debug("Send queue full, frame %s dropped", victim.key)
+            depth -= 1
+        item = _Item(priority, key, frame)
+        self._queues[priority].append(item)
+        if key is not None:
+            self._keys[key] = item
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, depth + 1)
+        return True
+
+    def pop_ready(self, now: float) -> list[bytes]:
+        """Remove and return the frames which can be sent now, in priority order."""
+        self._expire(now)
+        frames = []
+        for priority, queue in self._queues.items():
+            while queue:
+                item = queue[0]
+                if priority == Priority.POLL and item.key is not None:
+                    if len(self._in_flight) >= self.max_in_flight:
+                        break
+                    self._in_flight[item.key] = now
+                queue.popleft()
+                if item.key is not None:
+                    del self._keys[item.key]
+                frames.append(item.frame)
+        self.sent += len(frames)
+        return frames
+
+    def acknowledge(self, msg: str) -> bool:
+        """Record the response to a poll, return True if queued polls can be sent."""
+        return self._in_flight.pop(msg, None) is not None and bool(self._queues[Priority.POLL])
+
+    def blocked_until(self) -> float | None:
+        """Return the time at which the queued polls can be sent if they are blocked by the in-flight limit."""
+        if not self._queues[Priority.POLL] or len(self._in_flight) < self.max_in_flight:
+            return None
+        return min(self._in_flight.values()) + self.in_flight_timeout
+
+    def reset_in_flight(self) -> None:
+        """Forget the polls waiting for a response, after the connection was lost."""
+        self._in_flight.clear()
+
+    def clear(self) -> None:
+        """Drop all the queued frames."""
+        for queue in self._queues.values():
+            queue.clear()
+        self._keys.clear()
+        self._in_flight.clear()
+
+    def _expire(self, now: float) -> None:
+        if self._in_flight:
+            expired = [msg for msg, sent in self._in_flight.items() if now - sent >= self.in_flight_timeout]
+            for msg in expired:
+                _LOG.debug("No response to %s, removed from the frames in flight", msg)
+                del self._in_flight[msg]
+
+
+def create_queue(options: Any, device_id: str = "") -> OutboundQueue:
+    """Create a queue with the options of the device configuration, the invalid options are ignored with a warning."""
+    if not isinstance(options, dict):
+        if options is not None:
+            _LOG.warning("Invalid send queue options of %s will be ignored: %r", device_id, options)
+        return OutboundQueue()
+    valid_options = {}
+    for name, value in options.items():
+        expected = _OPTION_TYPES.get(name)
+        valid = expected is not None and isinstance(value, expected) and not isinstance(value, bool)
+        if valid and name == "overflow":
+            valid = value in {policy.value for policy in OverflowPolicy}
+        elif valid:
+            valid = value > 0
+        if valid:
+            valid_options[name] = value
+        else:
+            _LOG.warning("Invalid send queue option of %s will be ignored: %s=%r", device_id, name, value)
+    return OutboundQueue(**valid_options)
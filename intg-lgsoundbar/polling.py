@@ -0,0 +1,145 @@
+"""
+Polling of the LG soundbars, one shared scheduler serves all the devices.
+
+:copyright: (c) 2024 by Unfolded Circle ApS.
+:license: Mozilla Public License Version 2.0, see LICENSE for more details.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Protocol
+
+from const import POLL_MIN_DELAY, POLL_SPACING
+
+_LOG = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class PollRule:
+    """Polling rule of a message type."""
+
+    interval: float
+    """Polling interval in seconds."""
+    jitter: float
+    """Maximum random deviation in seconds added to the interval, spreads the requests of several devices."""
+    priority: int
+    """Lower values are requested first when several message types or devices are due."""
+    full_only: bool = False
+    """Besides its schedule, only requested by full updates of the device."""
+
+
+# Default polling table, the intervals can be overridden with poll_intervals in the device configuration
+POLL_RULES: dict[str, PollRule] = {
+    "PLAY_INFO": PollRule(interval=10, jitter=1, priority=0),
+    "SPK_LIST_VIEW_INFO": PollRule(interval=10, jitter=1, priority=0),
+    "FUNC_VIEW_INFO": PollRule(interval=10, jitter=2, priority=1),
+    "EQ_VIEW_INFO": PollRule(interval=30, jitter=5, priority=2),
+    "SETTING_VIEW_INFO": PollRule(interval=60, jitter=10, priority=3),
+    "C4A_SETTING_INFO": PollRule(interval=600, jitter=60, priority=4, full_only=True),
+    "PRODUCT_INFO": PollRule(interval=3600, jitter=300, priority=5, full_only=True),
+    "UPDATE_VIEW_INFO": PollRule(interval=3600, jitter=300, priority=5, full_only=True),
+}
+
+
+@dataclass
+class PollState:
+    """Polling state and statistics of a message type."""
+
+    rule: PollRule
+    requests: int = 0
+    responses: int = 0
+    pushes: int = 0
+    last_requested: float = float("-inf")
+    last_received: float = float("-inf")
+    last_pushed: float = float("-inf")
+    jitter: float = 0
+
+    def requested(self, now: float) -> None:
+        """Record a request of this message type and draw the jitter of the next one."""
+        self.requests += 1
+        self.last_requested = now
+        self.jitter = random.uniform(-self.rule.jitter, self.rule.jitter)
+
+
+class PolledDevice(Protocol):
+    """Device served by the polling scheduler."""
+
+    @property
+    def id(self) -> str:
+        """Identifier of the device."""
+
+    def next_poll(self) -> tuple[float, int]:
+        """Return the time and the best priority of the next due message types."""
+
+    async def poll_due(self) -> bool:
+        """Poll the due message types, return False to stop polling the device."""
+
+
+class PollScheduler:
+    """Shared scheduler of the polling requests of all devices."""
+
+    def __init__(self):
+        """Create the scheduler, its task is started with the first registered device."""
+        self._devices: dict[str, PolledDevice] = {}
+        self._polls: dict[str, asyncio.Task] = {}
+        self._task: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+
+    def register(self, device: PolledDevice) -> None:
+        """Start polling the given device."""
+        if device.id in self._devices:
+            return
+        _LOG.debug("Start polling device %s", device.id)
+        self._devices[device.id] = device
+        self._wakeup.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    def unregister(self, device: PolledDevice) -> None:
+        """Stop polling the given device."""
+        if self._devices.get(device.id) is device:
+            _LOG.debug("Stop polling device %s", device.id)
+            del self._devices[device.id]
+
+    def is_registered(self, device: PolledDevice) -> bool:
+        """Return True if the given device is polled."""
+        return self._devices.get(device.id) is device
+
+    async def _run(self) -> None:
+        while self._devices:
+            now = time.monotonic()
+            # A device still connecting or sending its previous poll is skipped, so that it never delays the others
+            schedule = [
+                (device.next_poll(), device) for device in self._devices.values() if device.id not in self._polls
+            ]
+            due = [(priority, when, device) for (when, priority), device in schedule if when <= now]
+            if not due:
+                delay = min((when for (when, _priority), _device in schedule), default=None)
+                self._wakeup.clear()
+                try:
+                    async with asyncio.timeout(None if delay is None else max(delay - now, POLL_MIN_DELAY)):
+                        await self._wakeup.wait()
+                except TimeoutError:
+                    pass
+                continue
+            # Start one device at a time, so that several soundbars are not all requested at once
+            _priority, _when, device = min(due, key=lambda item: item[:2])
+            self._polls[device.id] = asyncio.get_running_loop().create_task(self._poll(device))
+            await asyncio.sleep(POLL_SPACING)
+        self._task = None
+
+    async def _poll(self, device: PolledDevice) -> None:
+        try:
+            if not await device.poll_due():
+                self.unregister(device)
+        except Exception as ex:  # pylint: disable=W0718
+            _LOG.error("Error while polling device %s: %s", device.id, ex)
+        finally:
+            del self._polls[device.id]
+            self._wakeup.set()
+
+
+scheduler = PollScheduler()
@@ -6,7 +6,7 @@ Media-player entity functions.
 """
 import asyncio
 import logging
-from typing import Any
+from typing import Any, Collection
 
 from ucapi.media_player import States
 
@@ -17,6 +17,7 @@ from const import (
     LG_REMOTE_UI_PAGES,
     LG_SIMPLE_COMMANDS,
 )
+from state import DeviceState
 from ucapi import EntityTypes, Remote, StatusCodes
 from ucapi.remote import Attributes, Commands, Features, Options
 from ucapi.remote import States as RemoteStates
@@ -120,31 +121,17 @@ class LGRemote(Remote):
             await asyncio.sleep(delay)
         return res
 
-    def _key_update_helper(self, key: str, value: str | None, attributes):
-        # pylint: disable=R0801
-        if value is None:
-            return attributes
-
-        if key in self.attributes:
-            if self.attributes[key] != value:
-                attributes[key] = value
-        else:
-            attributes[key] = value
-
-        return attributes
-
-    def filter_changed_attributes(self, update: dict[str, Any]) -> dict[str, Any]:
+    def changed_attributes(self, state: DeviceState, fields: Collection[str]) -> dict[str, Any]:
         """
-        Filter the given attributes and return only the changed values.
+        Return the attributes of the given changed fields of the device state.
 
-        :param update: dictionary with attributes.
-        :return: filtered entity attributes containing changed attributes only.
+        :param state: device state.
+        :param fields: changed fields of the device state.
+        :return: entity attributes of the changed fields.
         """
-        attributes = {}
-
-        if Attributes.STATE in update:
-            state = LG_REMOTE_STATE_MAPPING.get(update[Attributes.STATE])
-            attributes = self._key_update_helper(Attributes.STATE, state, attributes)
-
-        _LOG.debug("LGRemote update attributes %s -> %s", update, attributes)
-        return attributes
+        if "state" not in fields:
+            return {}
+        remote_state = LG_REMOTE_STATE_MAPPING.get(state.state)
+        if remote_state == self.attributes.get(Attributes.STATE):
+            return {}
+        return {Attributes.STATE: remote_state}
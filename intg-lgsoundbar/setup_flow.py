@@ -9,11 +9,10 @@ import asyncio
 import logging
 from enum import IntEnum
 
-from ucapi.media_player import States
-
 import config
 from client import LGDevice
 from config import DeviceInstance
+from lglib import TemescalError
 from ucapi import (
     AbortDriverSetup,
     DriverSetupRequest,
@@ -278,13 +277,13 @@ async def _handle_discovery(msg: UserDataResponse) -> RequestUserInput | SetupEr
                     id=address, address=address, port=int(port), volume_step=volume_step, name="LG", always_on=False
                 )
             )
-            await device.update(True)
-            await asyncio.sleep(3)
-            if device.state == States.UNKNOWN:
-                _LOG.error("Cannot connect to manually entered address %s", address)
-                return SetupError(error_type=IntegrationSetupError.CONNECTION_REFUSED)
+            # The name and the serial number of the device are known as soon as it answers
+            await asyncio.gather(*(device.request(msg) for msg in ("SETTING_VIEW_INFO", "PRODUCT_INFO")))
             dropdown_items.append({"id": address, "label": {"en": f"{device.device_name}"}})
             _discovered_devices.append(device)
+        except TemescalError as ex:
+            _LOG.error("Cannot connect to manually entered address %s: %r", address, ex)
+            return SetupError(error_type=IntegrationSetupError.CONNECTION_REFUSED)
         except Exception as ex:
             _LOG.error("Cannot connect to manually entered address %s: %s", address, ex)
             return SetupError(error_type=IntegrationSetupError.CONNECTION_REFUSED)
@@ -0,0 +1,239 @@
+"""
+State model of the LG soundbars.
+
+:copyright: (c) 2024 by Unfolded Circle ApS.
+:license: Mozilla Public License Version 2.0, see LICENSE for more details.
+"""
+
+from dataclasses import dataclass, field, fields, replace
+from operator import attrgetter
+from typing import Any, Collection
+
+from lglib import equalisers, functions
+from ucapi.media_player import States
+
+
+@dataclass(slots=True)
+class DeviceState:
+    """
+    State of a LG soundbar.
+
+    The derived fields are recomputed by update_derived after each change, so that reading them is free.
+    Lists are replaced and never modified in place, a shallow copy is a consistent snapshot of the device.
+    """
+
+    power_state: bool = False
+    volume: float = 0.0
+    volume_min: int = 0
+    volume_max: int = 0
+    mute: bool = False
+    function: int = -1
+    functions: list[int] = field(default_factory=list)
+    equaliser: int = -1
+    equalisers: list[int] = field(default_factory=list)
+    bass: int = 0
+    treble: int = 0
+    rear_volume: int = 0
+    rear_volume_min: int = 0
+    rear_volume_max: int = 0
+    woofer_volume: int = 0
+    woofer_volume_min: int = 0
+    woofer_volume_max: int = 0
+    media_artist: str = ""
+    media_title: str = ""
+    media_position: int = 0
+    media_duration: int = 0
+    media_artwork: str = ""
+    device_name: str = "LG"
+    night_mode: bool = False
+    auto_volume_control: bool = False
+    dynamic_range_reduction: bool = False
+    neural_x: bool = False
+    tv_remote: bool = False
+    auto_display: bool = False
+    stream_type: int = 0
+    play_control: int = 0
+    serial_number: str | None = None
+
+    # Derived fields
+    state: States = States.OFF
+    play_state: States = States.UNKNOWN
+    volume_level: float = 0.0
+    source: str | None = None
+    source_list: list[str] = field(default_factory=list)
+    sound_mode: str | None = None
+    sound_mode_list: list[str] = field(default_factory=list)
+
+    def update_derived(self, changed: Collection[str] = ()) -> None:
+        """Recompute the derived fields after a change, the lists only if their source field is in changed."""
+        if "functions" in changed:
+            self.source_list = sorted(functions[function] for function in self.functions if function < len(functions))
+        if "equalisers" in changed:
+            self.sound_mode_list = sorted(
+                equalisers[equaliser] for equaliser in self.equalisers if equaliser < len(equalisers)
+            )
+        if self.stream_type == 0:
+            self.play_state = States.UNKNOWN
+        elif self.play_control == 1:
+            self.play_state = States.PAUSED
+        else:
+            self.play_state = States.PLAYING
+        if self.play_state != States.UNKNOWN:
+            self.state = self.play_state
+        else:
+            self.state = States.ON if self.power_state else States.OFF
+        if self.volume_max - self.volume_min == 0:
+            self.volume_level = 0
+        else:
+            self.volume_level = 100 * abs((self.volume - self.volume_min) / (self.volume_max - self.volume_min))
+        self.source = None if self.function == -1 or self.function >= len(functions) else functions[self.function]
+        self.sound_mode = (
+            None if self.equaliser == -1 or self.equaliser >= len(equalisers) else equalisers[self.equaliser]
+        )
+
+    def copy(self) -> "DeviceState":
+        """Return a snapshot of the state."""
+        return replace(self)
+
+    def to_snapshot(self) -> dict[str, Any]:
+        """Return the fields persisted across restarts."""
+        return {name: getattr(self, name) for name in sorted(SNAPSHOT_FIELDS)}
+
+    def restore(self, snapshot: dict[str, Any]) -> None:
+        """
+        Restore the fields of a snapshot, unknown keys are ignored.
+
+        Raise ValueError if a field has an invalid value, the state is then left unchanged.
+        """
+        restored = self.copy()
+        for name in SNAPSHOT_FIELDS:
+            if name in snapshot:
+                value = snapshot[name]
+                if not _valid_snapshot_value(value, getattr(_DEFAULT_STATE, name)):
+                    raise ValueError(f"invalid {name}: {value!r}")
+                setattr(restored, name, value)
+        restored.update_derived(("functions", "equalisers"))
+        for name in _FIELD_NAMES:
+            setattr(self, name, getattr(restored, name))
+
+
+def _valid_snapshot_value(value: Any, default: Any) -> bool:
+    """Return True if the value has the type of the default value of the field."""
+    if default is None:
+        return value is None or isinstance(value, str)
+    if isinstance(default, list):
+        return isinstance(value, list) and all(isinstance(item, int) and not isinstance(item, bool) for item in value)
+    if isinstance(default, bool):
+        return isinstance(value, bool)
+    if isinstance(default, float):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    if isinstance(default, int):
+        return isinstance(value, int) and not isinstance(value, bool)
+    return isinstance(value, type(default))
+
+
+_FIELD_NAMES = tuple(item.name for item in fields(DeviceState))
+_DEFAULT_STATE = DeviceState()
+
+# Capabilities and last state of the device, known before the first response after a restart
+SNAPSHOT_FIELDS = frozenset(
+    {
+        "functions",
+        "equalisers",
+        "volume_min",
+        "volume_max",
+        "rear_volume_min",
+        "rear_volume_max",
+        "woofer_volume_min",
+        "woofer_volume_max",
+        "serial_number",
+        "device_name",
+        "power_state",
+        "volume",
+        "mute",
+        "function",
+        "equaliser",
+    }
+)
+
+# Fields published to the entities
+PUBLISHED_FIELDS = (
+    "state",
+    "volume_level",
+    "mute",
+    "source",
+    "source_list",
+    "sound_mode",
+    "sound_mode_list",
+    "media_artwork",
+    "media_position",
+    "media_duration",
+    "media_title",
+    "media_artist",
+)
+
+_published_values = attrgetter(*PUBLISHED_FIELDS)
+
+
+_POSITION_INDEX = PUBLISHED_FIELDS.index("media_position")
+# A change of these fields publishes the media position with them
+_POSITION_TRIGGERS = frozenset({"state", "media_duration", "media_title", "media_artist"})
+
+
+class ChangeTracker:
+    """
+    Change detection of the published fields of a device state, against their last published values.
+
+    While a stream plays, the remote extrapolates the media position from the last published one. A new position is
+    only published with a play state or track change, when it differs from the extrapolated position by more than
+    seek_tolerance seconds, or position_interval seconds after the last published position (0 publishes all of them).
+    """
+
+    __slots__ = ("_published", "_position_time", "position_interval", "seek_tolerance")
+
+    def __init__(self, position_interval: float = 0, seek_tolerance: float = 3):
+        """Create a tracker, all the fields are changed until the first publication."""
+        self._published: tuple | None = None
+        self._position_time = 0.0
+        self.position_interval = position_interval
+        self.seek_tolerance = seek_tolerance
+
+    def changes(self, state: DeviceState, now: float = 0) -> list[str]:
+        """
+        Return the published fields changed since the previous call, and record their current values.
+
+        :param state: device state.
+        :param now: monotonic time in seconds, to throttle the media position.
+        """
+        values = _published_values(state)
+        previous, self._published = self._published, values
+        if previous is None:
+            self._position_time = now
+            return list(PUBLISHED_FIELDS)
+        # Lists are replaced and never modified in place, the identity check avoids most list comparisons
+        changed = [
+            name for name, value, old in zip(PUBLISHED_FIELDS, values, previous) if value is not old and value != old
+        ]
+        if "media_position" in changed:
+            if self._publish_position(state, previous[_POSITION_INDEX], changed, now):
+                self._position_time = now
+            else:
+                # Keep the last published position to extrapolate from it
+                changed.remove("media_position")
+                self._published = (
+                    values[:_POSITION_INDEX] + (previous[_POSITION_INDEX],) + values[_POSITION_INDEX + 1 :]
+                )
+        return changed
+
+    def _publish_position(self, state: DeviceState, published: int, changed: list[str], now: float) -> bool:
+        elapsed = now - self._position_time
+        if self.position_interval <= 0 or elapsed >= self.position_interval:
+            return True
+        if not _POSITION_TRIGGERS.isdisjoint(changed):
+            return True
+        expected = published + elapsed if state.state == States.PLAYING else published
+        return abs(state.media_position - expected) > self.seek_tolerance
+
+    def reset(self) -> None:
+        """Consider all the fields changed on the next call, when the published values were overridden."""
+        self._published = None
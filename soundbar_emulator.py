@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+LG soundbar emulator speaking the Temescal protocol, to test the driver without real hardware.
+
+Each instance listens on its own TCP port, keeps the state of the main message types, answers get and set commands
+and can inject latency, dropped responses, partial writes and unsolicited pushes.
+
+python3 soundbar_emulator.py --count 3 --port 9741 --latency 0.05 --drop-rate 0.01 --push-interval 5
+
+:copyright: (c) 2024 by Unfolded Circle ApS.
+:license: Mozilla Public License Version 2.0, see LICENSE for more details.
+"""
+
+import argparse
+import asyncio
+import copy
+import json
+import logging
+import os
+import random
+import sys
+from dataclasses import dataclass
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "intg-lgsoundbar"))
+
+# pylint: disable=C0413,E0401
+from framing import FrameDecoder, decode_payload, encode_frame  # noqa: E402
+
+_LOG = logging.getLogger("emulator")
+
+DEFAULT_STATE = {
+    "SPK_LIST_VIEW_INFO": {
+        "b_powerstatus": True,
+        "i_vol": 7,
+        "i_vol_min": 0,
+        "i_vol_max": 40,
+        "b_mute": False,
+        "i_curr_func": 6,
+        "s_user_name": "LG_Speaker_EMU",
+    },
+    "FUNC_VIEW_INFO": {"i_curr_func": 6, "b_connect": True, "ai_func_list": [0, 1, 6, 15, 20]},
+    "EQ_VIEW_INFO": {"i_curr_eq": 19, "i_bass": 5, "i_treble": 5, "ai_eq_list": [0, 5, 6, 7, 14, 15, 19, 21, 22]},
+    "SETTING_VIEW_INFO": {
+        "s_user_name": "LG_Speaker_EMU",
+        "i_curr_eq": 19,
+        "b_night_mode": False,
+        "b_auto_vol": False,
+        "b_drc": False,
+        "b_neuralx": False,
+        "b_tv_remote": True,
+        "b_auto_display": False,
+        "i_rear_min": -6,
+        "i_rear_max": 6,
+        "i_rear_level": 0,
+        "i_woofer_min": -15,
+        "i_woofer_max": 6,
+        "i_woofer_level": 0,
+    },
+    "PLAY_INFO": {
+        "i_stream_type": 0,
+        "i_play_ctrl": 0,
+        "i_position": 0,
+        "i_duration": 0,
+        "s_title": "",
+        "s_artist": "",
+        "s_albumart": "",
+    },
+    "PRODUCT_INFO": {"s_uuid": "", "i_model_no": 8, "s_model_name": "EMU"},
+    "C4A_SETTING_INFO": {"b_c4a_enable": True},
+    "UPDATE_VIEW_INFO": {"b_update": False},
+}
+
+# Keys reported by several message types
+SHARED_KEYS = {
+    "i_curr_func": ("SPK_LIST_VIEW_INFO", "FUNC_VIEW_INFO"),
+    "i_curr_eq": ("EQ_VIEW_INFO", "SETTING_VIEW_INFO"),
+    "s_user_name": ("SPK_LIST_VIEW_INFO", "SETTING_VIEW_INFO"),
+}
+
+
+@dataclass
+class Faults:
+    """Faults injected by the emulator."""
+
+    latency: float = 0
+    """Delay in seconds before each response."""
+    jitter: float = 0
+    """Maximum random delay in seconds added to the latency."""
+    drop_rate: float = 0
+    """Probability to not answer a request."""
+    partial_writes: bool = False
+    """Split the responses in random chunks sent separately."""
+    push_interval: float = 0
+    """Interval in seconds of unsolicited PLAY_INFO pushes, 0 to disable."""
+
+
+class SoundbarEmulator:
+    """Emulated LG soundbar."""
+
+    def __init__(self, name: str, host: str = "127.0.0.1", port: int = 0, faults: Faults | None = None):
+        """Create an emulated soundbar, port 0 picks a free port."""
+        self.name = name
+        self.host = host
+        self.port = port
+        self.faults = faults or Faults()
+        self.state = copy.deepcopy(DEFAULT_STATE)
+        self.state["PRODUCT_INFO"]["s_uuid"] = f"emulator-{name}"
+        self.requests: list[dict] = []
+        self._server: asyncio.Server | None = None
+        self._clients: set[asyncio.StreamWriter] = set()
+        self._push_task: asyncio.Task | None = None
+
+    async def start(self) -> None:
+        """Start listening."""
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        if self.faults.push_interval > 0:
+            self._push_task = asyncio.get_running_loop().create_task(self._push_loop())
+        _LOG.info("Soundbar %s listening on %s:%d", self.name, self.host, self.port)
+
+    async def stop(self) -> None:
+        """Stop listening and close the client connections."""
+        if self._push_task:
+            self._push_task.cancel()
+            self._push_task = None
+        for writer in list(self._clients):
+            writer.close()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def apply(self, msg: str, data: dict) -> None:
+        """Apply the data of a set command to the state."""
+        if "b_powerkey" in data:
+            self.state["SPK_LIST_VIEW_INFO"]["b_powerstatus"] = data["b_powerkey"]
+        for key, value in data.items():
+            if key == "b_powerkey":
+                continue
+            for target in SHARED_KEYS.get(key, (msg,)):
+                self.state.setdefault(target, {})[key] = value
+
+    async def push(self, msg: str) -> None:
+        """Send the state of the given message type to all clients."""
+        for writer in list(self._clients):
+            await self._send(writer, {"msg": msg, "cmd": "noti", "data": self.state.get(msg, {}), "result": "ok"})
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self._clients.add(writer)
+        decoder = FrameDecoder()
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                buffer = decoder.get_buffer(len(data))
+                buffer[:len(data)] = data
+                for frame in decoder.buffer_updated(len(data)):
+                    await self._handle_request(writer, json.loads(decode_payload(frame)))
+        except (ConnectionError, ValueError) as ex:
+            _LOG.debug("Soundbar %s: client error %s", self.name, ex)
+        finally:
+            self._clients.discard(writer)
+            writer.close()
+
+    async def _handle_request(self, writer: asyncio.StreamWriter, request: dict) -> None:
+        self.requests.append(request)
+        msg = request.get("msg", "")
+        if request.get("cmd") == "set":
+            self.apply(msg, request.get("data") or {})
+            for target in self._targets(msg, request.get("data") or {}):
+                await self._send(writer, {"msg": target, "cmd": "noti", "data": self.state[target], "result": "ok"})
+            return
+        if random.random() < self.faults.drop_rate:
+            _LOG.debug("Soundbar %s: dropping %s", self.name, msg)
+            return
+        if msg in self.state:
+            response = {"msg": msg, "cmd": "notibyget", "data": self.state[msg], "result": "ok"}
+        else:
+            response = {"msg": msg, "cmd": "notibyget", "result": "sorry not support"}
+        await self._send(writer, response)
+
+    def _targets(self, msg: str, data: dict) -> set[str]:
+        targets = {msg} if msg in self.state else set()
+        for key in data:
+            targets.update(SHARED_KEYS.get(key, ()))
+        if "b_powerkey" in data:
+            targets.add("SPK_LIST_VIEW_INFO")
+        return targets
+
+    async def _send(self, writer: asyncio.StreamWriter, response: dict) -> None:
+        delay = self.faults.latency + random.uniform(0, self.faults.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        frame = encode_frame(json.dumps(response))
+        if not self.faults.partial_writes:
+            writer.write(frame)
+        else:
+            start = 0
+            while start < len(frame):
+                end = min(len(frame), start + random.randint(1, 32))
+                writer.write(frame[start:end])
+                await writer.drain()
+                start = end
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def _push_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.faults.push_interval)
+            play_info = self.state["PLAY_INFO"]
+            if play_info["i_stream_type"] and play_info["i_play_ctrl"] == 0:
+                play_info["i_position"] += max(1, round(self.faults.push_interval))
+            await self.push("PLAY_INFO")
+
+
+async def start_emulators(
+    count: int, host: str = "127.0.0.1", port: int = 0, faults: Faults | None = None
+) -> list[SoundbarEmulator]:
+    """Start the given number of emulated soundbars on consecutive ports, or free ports if port is 0."""
+    emulators = []
+    for index in range(count):
+        emulator = SoundbarEmulator(str(index), host, port + index if port else 0, faults)
+        await emulator.start()
+        emulators.append(emulator)
+    return emulators
+
+
+async def main():
+    """Run the emulated soundbars until interrupted."""
+    parser = argparse.ArgumentParser(description="LG soundbar emulator")
+    parser.add_argument("--count", type=int, default=1, help="number of soundbars")
+    parser.add_argument("--host", default="127.0.0.1", help="listening address")
+    parser.add_argument("--port", type=int, default=9741, help="port of the first soundbar, 0 for free ports")
+    parser.add_argument("--latency", type=float, default=0, help="response delay in seconds")
+    parser.add_argument("--jitter", type=float, default=0, help="maximum random delay added to the latency")
+    parser.add_argument("--drop-rate", type=float, default=0, help="probability to not answer a get request")
+    parser.add_argument("--partial-writes", action="store_true", help="split the responses in random chunks")
+    parser.add_argument("--push-interval", type=float, default=0, help="interval of PLAY_INFO pushes in seconds")
+    parser.add_argument("--playing", action="store_true", help="start with a playing Google Cast stream")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG)
+    faults = Faults(args.latency, args.jitter, args.drop_rate, args.partial_writes, args.push_interval)
+    emulators = await start_emulators(args.count, args.host, args.port, faults)
+    if args.playing:
+        for emulator in emulators:
+            emulator.state["PLAY_INFO"].update({"i_stream_type": 1, "i_duration": 240, "s_title": "Emulated track"})
+    try:
+        await asyncio.Event().wait()
+    finally:
+        for emulator in emulators:
+            await emulator.stop()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
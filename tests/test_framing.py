@@ -0,0 +1,87 @@
+"""
+Tests of the framing codec of the LG soundbar protocol.
+
+:copyright: (c) 2024 by Unfolded Circle ApS.
+:license: Mozilla Public License Version 2.0, see LICENSE for more details.
+"""
+
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "intg-lgsoundbar"))
+
+# pylint: disable=C0413,E0401
+from framing import (  # noqa: E402
+    FRAME_HEADER_SIZE,
+    FRAME_MARKER,
+    FrameDecoder,
+    decode_payload,
+    encode_frame,
+)
+
+MESSAGES = {
+    "ascii": json.dumps({"cmd": "get", "msg": "SPK_LIST_VIEW_INFO"}),
+    "non_ascii": json.dumps({"data": {"s_user_name": "Barre de son du séjour ♫"}}, ensure_ascii=False),
+    "large": json.dumps({"data": {"s_title": "x" * 300, "s_artist": "é" * 100}}, ensure_ascii=False),
+}
+
+
+def feed(decoder: FrameDecoder, data: bytes) -> list[str]:
+    """Read the given bytes into the decoder like the socket does and return the decoded messages."""
+    buffer = decoder.get_buffer(len(data))
+    buffer[: len(data)] = data
+    return [decode_payload(frame) for frame in decoder.buffer_updated(len(data))]
+
+
+@pytest.mark.parametrize("message", MESSAGES.values(), ids=MESSAGES.keys())
+def test_round_trip(message: str):
+    """A frame is decoded to the encoded message."""
+    frame = encode_frame(message)
+    assert frame[0] == FRAME_MARKER
+    assert int.from_bytes(frame[1:FRAME_HEADER_SIZE], "big") == len(frame) - FRAME_HEADER_SIZE
+    assert feed(FrameDecoder(), frame) == [message]
+
+
+def test_large_payload_length():
+    """The length of a payload over 255 bytes is not truncated to its lowest byte."""
+    frame = encode_frame(MESSAGES["large"])
+    assert len(frame) - FRAME_HEADER_SIZE > 255
+    assert feed(FrameDecoder(), frame) == [MESSAGES["large"]]
+
+
+def test_several_frames_in_one_read():
+    """All the frames received in one read are decoded in order."""
+    data = b"".join(encode_frame(message) for message in MESSAGES.values())
+    assert feed(FrameDecoder(), data) == list(MESSAGES.values())
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, FRAME_HEADER_SIZE, 16, 100])
+def test_chunked_stream(chunk_size: int):
+    """Partial frames are kept until the rest of them is received."""
+    data = b"".join(encode_frame(message) for message in MESSAGES.values())
+    decoder = FrameDecoder(size=64)
+    messages = []
+    for index in range(0, len(data), chunk_size):
+        messages += feed(decoder, data[index : index + chunk_size])
+    assert messages == list(MESSAGES.values())
+
+
+@pytest.mark.parametrize(
+    "garbage",
+    [b"\x00\x01\x02", bytes((FRAME_MARKER,)) + b"\x00\x00\x00\x07", bytes((FRAME_MARKER, 0xFF))],
+    ids=["no_marker", "invalid_length", "oversized_length"],
+)
+def test_garbage_prefix(garbage: bytes):
+    """Unexpected bytes before a frame are skipped."""
+    frame = encode_frame(MESSAGES["ascii"])
+    assert feed(FrameDecoder(), garbage + frame) == [MESSAGES["ascii"]]
+
+
+def test_garbage_between_chunks():
+    """Unexpected bytes received alone are dropped and the next frame is decoded."""
+    decoder = FrameDecoder()
+    assert not feed(decoder, b"garbage")
+    assert feed(decoder, encode_frame(MESSAGES["non_ascii"])) == [MESSAGES["non_ascii"]]
@@ -0,0 +1,75 @@
+"""
+Tests of the outbound queue of the frames sent to a LG soundbar.
+
+:copyright: (c) 2024 by Unfolded Circle ApS.
+:license: Mozilla Public License Version 2.0, see LICENSE for more details.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "intg-lgsoundbar"))
+
+# pylint: disable=C0413,E0401
+from lglib import QueueFullError, Temescal  # noqa: E402
+from outbound import OutboundQueue, OverflowPolicy, Priority, create_queue  # noqa: E402
+
+
+@pytest.mark.parametrize("overflow", list(OverflowPolicy))
+def test_command_evicts_poll(overflow: OverflowPolicy):
+    """A command added to a full queue evicts a queued poll."""
+    queue = OutboundQueue(max_size=2, overflow=overflow)
+    assert queue.put(b"poll", Priority.POLL, "PLAY_INFO")
+    assert queue.put(b"command1", Priority.COMMAND)
+    assert queue.put(b"command2", Priority.COMMAND)
+    assert queue.pop_ready(0) == [b"command1", b"command2"]
+    assert queue.dropped == 1
+
+
+@pytest.mark.parametrize("overflow", list(OverflowPolicy))
+def test_queued_commands_are_kept(overflow: OverflowPolicy):
+    """A frame added to a queue full of commands is dropped, the queued commands are sent."""
+    queue = OutboundQueue(max_size=2, overflow=overflow)
+    assert queue.put(b"command1", Priority.COMMAND)
+    assert queue.put(b"command2", Priority.COMMAND)
+    assert not queue.put(b"command3", Priority.COMMAND)
+    assert not queue.put(b"poll", Priority.POLL, "PLAY_INFO")
+    assert queue.pop_ready(0) == [b"command1", b"command2"]
+    assert queue.dropped == 2
+
+
+@pytest.mark.parametrize("overflow, sent", [("drop_oldest", b"poll2"), ("drop_new", b"poll1")])
+def test_poll_overflow(overflow: str, sent: bytes):
+    """The overflow policy selects the poll dropped from a full queue."""
+    queue = OutboundQueue(max_size=1, overflow=overflow)
+    assert queue.put(b"poll1", Priority.POLL, "PLAY_INFO")
+    assert queue.put(b"poll2", Priority.POLL, "EQ_VIEW_INFO") == (overflow == "drop_oldest")
+    assert queue.pop_ready(0) == [sent]
+
+
+class PausedTransport:
+    """Open transport whose writes are paused by the flow control."""
+
+    def is_closing(self) -> bool:
+        """Return False, the transport is open."""
+        return False
+
+
+def test_dropped_command_raises():
+    """A command which doesn't fit in the send queue is reported as failed."""
+    device = Temescal("127.0.0.1", send_queue=OutboundQueue(max_size=1))
+    # pylint: disable=W0212
+    device._transport = PausedTransport()
+    device._paused = True
+    device.set_mute(True)
+    with pytest.raises(QueueFullError):
+        device.set_mute(False)
+
+
+def test_invalid_options_ignored():
+    """The invalid options of the configuration are replaced by the default values."""
+    queue = create_queue({"max_size": 8, "overflow": "drop_all", "max_in_flight": "2", "unknown": 1}, "lg")
+    assert (queue.max_size, queue.overflow, queue.max_in_flight) == (8, OverflowPolicy.DROP_OLDEST, 4)
+    assert create_queue(["drop_new"], "lg").max_size == OutboundQueue().max_size
@@ -0,0 +1,56 @@
+"""
+Tests of the shared polling scheduler.
+
+:copyright: (c) 2024 by Unfolded Circle ApS.
+:license: Mozilla Public License Version 2.0, see LICENSE for more details.
+"""
+
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "intg-lgsoundbar"))
+
+# pylint: disable=C0413,E0401
+from polling import PollScheduler  # noqa: E402
+
+
+class FakeDevice:
+    """Device polled every second, each poll lasting the given duration."""
+
+    def __init__(self, device_id: str, duration: float):
+        """Create the device."""
+        self.id = device_id
+        self.duration = duration
+        self.polls: list[float] = []
+        self._last = float("-inf")
+
+    def next_poll(self) -> tuple[float, int]:
+        """Return the time of the next poll."""
+        return self._last + 1, 0
+
+    async def poll_due(self) -> bool:
+        """Record the poll and wait for its duration."""
+        self._last = time.monotonic()
+        self.polls.append(self._last)
+        await asyncio.sleep(self.duration)
+        return True
+
+
+def test_slow_device_does_not_delay_the_others():
+    """A device connecting for longer than the polling interval doesn't delay the polls of the other devices."""
+
+    async def run():
+        scheduler = PollScheduler()
+        slow, healthy = FakeDevice("slow", duration=10), FakeDevice("healthy", duration=0)
+        scheduler.register(slow)
+        scheduler.register(healthy)
+        await asyncio.sleep(3.5)
+        scheduler.unregister(slow)
+        scheduler.unregister(healthy)
+        return slow, healthy
+
+    slow, healthy = asyncio.run(run())
+    assert len(slow.polls) == 1
+    assert len(healthy.polls) >= 3
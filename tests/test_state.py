@@ -0,0 +1,82 @@
+"""
+Tests of the state snapshots of the LG soundbars.
+
+:copyright: (c) 2024 by Unfolded Circle ApS.
+:license: Mozilla Public License Version 2.0, see LICENSE for more details.
+"""
+
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "intg-lgsoundbar"))
+
+# pylint: disable=C0413,E0401
+from client import LGDevice  # noqa: E402
+from config import DeviceInstance  # noqa: E402
+from state import DeviceState  # noqa: E402
+
+
+def reported_state() -> DeviceState:
+    """Return the state of a soundbar after its first responses and a volume command."""
+    state = DeviceState(
+        power_state=True,
+        volume=7.4,
+        volume_max=40,
+        mute=True,
+        function=6,
+        functions=[0, 1, 6, 15],
+        equaliser=1,
+        equalisers=[0, 1, 2],
+        serial_number="SN",
+        device_name="Living room",
+    )
+    state.update_derived(("functions", "equalisers"))
+    return state
+
+
+def test_snapshot_round_trip():
+    """A snapshot saved as JSON restores the same state, including a float volume."""
+    state = reported_state()
+    restored = DeviceState()
+    restored.restore(json.loads(json.dumps(state.to_snapshot())))
+    assert restored == state
+
+
+@pytest.mark.parametrize(
+    "name, value", [("volume", "7"), ("volume", True), ("functions", [0, "1"]), ("power_state", 1)]
+)
+def test_invalid_snapshot(name: str, value):
+    """A snapshot with an invalid field is rejected and leaves the state unchanged."""
+    state = DeviceState()
+    snapshot = reported_state().to_snapshot() | {name: value}
+    with pytest.raises(ValueError):
+        state.restore(snapshot)
+    assert state == DeviceState()
+
+
+def test_device_snapshot_round_trip(tmp_path):
+    """The state saved by a device is loaded by the next instance of the device."""
+
+    async def save_and_load():
+        path = str(tmp_path / "snapshot.json")
+        config = DeviceInstance(id="lg", name="LG", address="", port=0, volume_step=1, always_on=False)
+        device = LGDevice(config, snapshot_path=path)
+        for name in ("power_state", "volume", "volume_max", "function", "functions"):
+            setattr(device.data, name, getattr(reported_state(), name))
+        device.data.update_derived(("functions",))
+        assert device.save_snapshot()
+        device.discard_snapshot()
+
+        loaded = LGDevice(config, snapshot_path=path)
+        assert loaded.load_snapshot()
+        loaded.discard_snapshot()
+        return device.data, loaded.data
+
+    saved, loaded = asyncio.run(save_and_load())
+    assert loaded.volume == 7.4
+    assert loaded.source_list == saved.source_list
+    assert loaded.to_snapshot() == saved.to_snapshot()